@@ -1,6 +1,7 @@
 #!/usr/bin/env python
-import time
 from math import sqrt
+from array import array
+from bisect import bisect_right
 from yaml import load
 
 from twisted.logger import Logger
@@ -9,9 +10,12 @@ from twisted.internet.protocol import ReconnectingClientFactory as RCFactory
 
 from pymodbus.constants import Endian
 from pymodbus.constants import Defaults
-from pymodbus.payload import BinaryPayloadDecoder
+from pymodbus.payload import RegisterDecoder
 from pymodbus.client.async import ModbusClientProtocol
 
+from app.scheduler import PollScheduler
+from app.scheduler import StallMonitor
+
 ROBOT_ADDRESS = '192.168.0.2'
 
 class PIProtocol(ModbusClientProtocol):
@@ -19,23 +23,56 @@ class PIProtocol(ModbusClientProtocol):
     TRAVERSE_PREFIX = "T"
     TOUCH_PREFIX = "P"
     RATIO_CFG = "/etc/tcp_ratio.yaml"
+    RATIO_LIMIT = 10000
+    XYZ_DECODER = RegisterDecoder('fff', byteorder=Endian.Big, wordorder=Endian.Big)
+    DEBOUNCE = 0.05
+    FILTER_GLITCHES = False
+    IDLE = "idle"
+    TOUCHED = "touched"
+    LATCHED = "latched"
+    RELEASED = "released"
 
     def __init__(self, framer=None):
         ModbusClientProtocol.__init__(self, framer=framer)
-        self.ratio_map = {}
+        self.ratio_bounds = []
+        self.ratio_limit = self.RATIO_LIMIT
+        self.ratio_map = []
         self.load_ratio_map()
+        self.touch_state = self.IDLE
+        self.touch_call = None
+        self.scheduler = None
+        self.monitor = None
+
+    def connectionMade(self):
+        ModbusClientProtocol.connectionMade(self)
         self.log.debug("beginning the processing loop")
-        reactor.callLater(0, self.fetch_tcp_registers)
-        reactor.callLater(0, self.fetch_flag_register)
-        self.previous_touched = False
+        self.scheduler = PollScheduler(self.fetch_tcp_registers,
+                                       self.send_traverse_points,
+                                       self.interval,
+                                       self.factory.window)
+        self.scheduler.start()
+        self.monitor = StallMonitor()
+        self.monitor.start()
+        self.schedule_touch(0, self.fetch_flag_register)
+
+    def connectionLost(self, reason):
+        if self.touch_call is not None and self.touch_call.active():
+            self.touch_call.cancel()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.log.info("traverse stream stats {}".format(self.scheduler.stats()))
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.log.info("reactor stall stats {}".format(self.monitor.stats()))
+        ModbusClientProtocol.connectionLost(self, reason)
 
     @property
     def interval(self):
-        return self.factory.interval / 1000
+        return self.factory.interval / 1000.0
 
     @property
     def interval_after_touched(self):
-        return self.factory.interval_after_touched / 1000
+        return self.factory.interval_after_touched / 1000.0
 
     @property
     def client(self):
@@ -54,24 +91,54 @@ class PIProtocol(ModbusClientProtocol):
 
         """
         d = self.read_discrete_inputs(800, 1)
-        d.addCallbacks(self.on_received_flag, self.error_handler)
+        d.addCallbacks(self.on_received_flag, self.flag_error_handler)
+
+    def schedule_touch(self, delay, f, *args):
+        self.touch_call = reactor.callLater(delay, f, *args)
 
     def on_received_flag(self, response):
-        flag = True if response.getBit(0) else False
-        if not flag:
-            self.log.info("touch happened")
-            if self.previous_touched:
-                self.log.info("previous touched is True, skip continus touch point signal")
-                self.log.info("start next cycle to fetch flag")
-                reactor.callLater(self.interval * 2, self.fetch_flag_register)
+        """Touch state machine, DI 0 reads 0 while touching:
+
+        idle     -- touch --> latched   read touch points after DEBOUNCE
+                                        + interval_after_touched
+        latched  -- touch --> latched   skip continuous touch signal
+        latched  -- free  --> released
+        released -- touch --> latched   as from idle
+        released -- free  --> idle
+
+        With FILTER_GLITCHES set, a first touch goes to touched instead
+        and the flag is read again after DEBOUNCE:
+
+        touched  -- touch --> latched   read touch points after
+                                        interval_after_touched
+        touched  -- free  --> idle      glitch, ignored
+        """
+        touched = not response.getBit(0)
+        state = self.touch_state
+        if touched:
+            self.log.info("touch happened in state {}".format(state))
+            if state in (self.IDLE, self.RELEASED):
+                if self.FILTER_GLITCHES:
+                    self.touch_state = self.TOUCHED
+                    self.schedule_touch(self.DEBOUNCE, self.fetch_flag_register)
+                else:
+                    self.touch_state = self.LATCHED
+                    self.schedule_touch(self.DEBOUNCE + self.interval_after_touched,
+                                        self.fetch_touch_points)
+                return
+            if state == self.TOUCHED:
+                self.touch_state = self.LATCHED
+                self.schedule_touch(self.interval_after_touched, self.fetch_touch_points)
                 return
-            self.previous_touched = True
-            time.sleep(0.05)
-            reactor.callLater(self.interval_after_touched, self.fetch_tcp_registers, True)
+            self.log.info("touch latched, skip continus touch point signal")
+        elif state == self.LATCHED:
+            self.touch_state = self.RELEASED
         else:
-            self.log.info("start next cycle for touched")
-            self.previous_touched = False
-            reactor.callLater(self.interval * 2, self.fetch_flag_register)
+            if state == self.TOUCHED:
+                self.log.info("touch released while debouncing, ignored")
+            self.touch_state = self.IDLE
+        self.log.info("start next cycle to fetch flag")
+        self.schedule_touch(self.interval * 2, self.fetch_flag_register)
 
     def fetch_tcp_registers(self, touched=False):
         """TM specification:
@@ -86,101 +153,104 @@ class PIProtocol(ModbusClientProtocol):
         Order : ABCD -> ABCD BigEndian
         """
         self.log.debug("fetching TCP registers touched={}".format(touched))
-        if touched:
-            d = self.read_input_registers(7425, 6)
-            d.addCallbacks(self.send_touch_points, self.error_handler)
-        else:
-            d = self.read_input_registers(7025, 6)
-            d.addCallbacks(self.send_traverse_points, self.error_handler)
+        return self.read_input_registers(7425 if touched else 7025, 6)
+
+    def fetch_touch_points(self):
+        d = self.fetch_tcp_registers(touched=True)
+        d.addCallbacks(self.send_touch_points, self.touch_error_handler)
 
     def send_traverse_points(self, response):
         registers = response.registers
         x, y, z = self.decode_xyz(registers)
         self.client.send("{},{},{},{}".format(self.TRAVERSE_PREFIX, *(x, y, z)))
-        self.log.info("start next cycle to fetch tcp")
-        reactor.callLater(self.interval, self.fetch_tcp_registers)
 
     def send_touch_points(self, response):
         registers = response.registers
         x, y, z = self.decode_xyz(registers)
         self.client.send("{},{},{},{}".format(self.TOUCH_PREFIX, *(x, y, z)))
         self.log.info("start next cycle to fetch flag")
-        reactor.callLater(self.interval * 2, self.fetch_flag_register)
+        self.schedule_touch(self.interval * 2, self.fetch_flag_register)
 
     def decode_xyz(self, payload):
-        def registers_to_str(r):
-            h = (r >> 8) & 0xff
-            l = r & 0xff
-            return "{}{}".format(chr(h), chr(l))
-
-        self.log.info('original payload ={}'.format(payload))
-        str_payload = "{}{}{}{}{}{}".format(
-            registers_to_str(payload[0]),
-            registers_to_str(payload[1]),
-            registers_to_str(payload[2]),
-            registers_to_str(payload[3]),
-            registers_to_str(payload[4]),
-            registers_to_str(payload[5])
-        )
-        decoder = BinaryPayloadDecoder(str_payload, endian=Endian.Big)
-        x = decoder.decode_32bit_float()
-        y = decoder.decode_32bit_float()
-        z = decoder.decode_32bit_float()
-        self.log.info('x={}, y={}, z={}'.format(x, y, z))
+        x, y, z = self.XYZ_DECODER.decode(payload)
+        self.log.debug('payload={}, x={}, y={}, z={}'.format(payload, x, y, z))
         ratio = self.get_ratio(x, y, z)
-        x *= ratio
-        y *= ratio
-        z *= ratio
-        self.log.info('x={}, y={}, z={}'.format(x, y, z))
-        return (x, y, z)
+        return (x * ratio, y * ratio, z * ratio)
 
     def load_ratio_map(self):
+        """Compile the ratio configuration into a lookup table.
+
+        Z lower boundaries are kept sorted in `ratio_bounds` for bisect and
+        each Z bin maps to a dense array of ratios indexed by the integer
+        radius. The last range of both levels ends at RATIO_LIMIT.
+        """
         with open(self.RATIO_CFG) as handle:
             d = load(handle)
 
         def load_sub_map(z, z_map):
-            sub_map = {}
             keys = sorted(z_map.keys())
             if keys[0]:
                 raise Exception("Missed specifying 0 for Z={}".format(z))
             ext_keys = keys[1:]
-            ext_keys.append(10000)
+            ext_keys.append(self.RATIO_LIMIT)
+            table = array('d', [0.0]) * max(keys[-1], self.RATIO_LIMIT)
             for l, h in zip(keys, ext_keys):
-                sub_map[xrange(l, h)] = z_map[l]
-            for k, v in sub_map.items():
-                self.log.info("{}: {}".format(k, v))
-            return sub_map
+                if l < h:
+                    table[l:h] = array('d', [z_map[l]]) * (h - l)
+                self.log.info("{}: {}".format(xrange(l, h), z_map[l]))
+            return table
 
         keys = sorted(d.keys())
         ext_keys = keys[1:]
-        ext_keys.append(10000)
-        for l, h in zip(keys, ext_keys):
-            self.ratio_map[xrange(l, h)] = load_sub_map(xrange(l, h), d[l])
+        ext_keys.append(self.RATIO_LIMIT)
+        self.ratio_bounds = keys
+        self.ratio_limit = max(keys[-1], self.RATIO_LIMIT)
+        self.ratio_map = [load_sub_map(xrange(l, h), d[l])
+                          for l, h in zip(keys, ext_keys)]
 
     def get_ratio(self, x, y, z):
         radius = int(sqrt(x*x + y*y + z*z))
-        for k, v in self.ratio_map.items():
-            if int(z) in k:
-                for sub_k, sub_v in v.items():
-                    if radius in sub_k:
-                        return sub_v
-        raise Exception("should never be here")
+        z = int(z)
+        index = bisect_right(self.ratio_bounds, z) - 1
+        if index < 0 or z >= self.ratio_limit:
+            raise Exception("should never be here")
+        table = self.ratio_map[index]
+        if radius >= len(table):
+            raise Exception("should never be here")
+        return table[radius]
 
     def error_handler(self, failure):
         self.log.error(str(failure))
 
+    def flag_error_handler(self, failure):
+        """A failed flag read keeps the touch state, the flag is read again."""
+        self.error_handler(failure)
+        if self._connected:
+            self.log.info("fetch flag again after error")
+            self.schedule_touch(self.interval * 2, self.fetch_flag_register)
+
+    def touch_error_handler(self, failure):
+        """A failed touch points read drops the touch, back to idle."""
+        self.error_handler(failure)
+        if self._connected:
+            self.touch_state = self.IDLE
+            self.log.info("start next cycle to fetch flag after error")
+            self.schedule_touch(self.interval * 2, self.fetch_flag_register)
+
 
 class PIFactory(RCFactory):
     protocol = PIProtocol
     client = None
     interval = None
     interval_after_touched = None
+    window = 1
     running = False
 
-    def __init__(self, client, interval, interval_after_touched):
+    def __init__(self, client, interval, interval_after_touched, window=1):
         self.client = client
         self.interval = interval
         self.interval_after_touched  = interval_after_touched
+        self.window = window
 
     def startedConnecting(self, connector):
         self.running = True
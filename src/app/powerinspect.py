@@ -1,46 +1,160 @@
 #!/usr/bin/env python
+from collections import deque
+
+from zope.interface import implementer
 from twisted.logger import Logger
 from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 from twisted.internet.protocol import Factory
 from twisted.internet.protocol import Protocol
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.endpoints import TCP4ServerEndpoint
 
 
+@implementer(IPushProducer)
 class PowerInspect(Protocol):
+    """A PowerInspect client fed through a bounded send queue.
+
+    The protocol registers itself as a streaming producer on its
+    transport. While the transport is paused lines are queued: traverse
+    points are dropped oldest first once `queue_size` of them are
+    waiting, touch points are never dropped.
+    """
     log = Logger(namespace="PowerInspect")
+    TRAVERSE_PREFIX = "T"
 
-    def __init__(self, factory):
+    def __init__(self, factory, address=None):
         self.factory = factory
+        self.address = address
+        self.paused = False
+        self.paused_at = None
+        self.sequence = 0
+        self.traverse = deque(maxlen=factory.queue_size)
+        self.touch = deque()
+        self.sent = 0
+        self.dropped = 0
 
     def connectionMade(self):
         self.log.info("connection made")
+        self.transport.registerProducer(self, True)
 
     def connectionLost(self, transport):
-        self.log.info("connection lost")
+        self.log.info("connection lost {}".format(self.stats()))
+        self.factory.removeConnection(self)
+
+    @property
+    def depth(self):
+        return len(self.traverse) + len(self.touch)
+
+    def stats(self):
+        return {"peer": str(self.address), "depth": self.depth,
+                "sent": self.sent, "dropped": self.dropped}
+
+    def send(self, line):
+        if not self.paused and not self.depth:
+            self.sent += 1
+            self.transport.write(line)
+            return
+        self.sequence += 1
+        if line.startswith(self.TRAVERSE_PREFIX):
+            if len(self.traverse) == self.traverse.maxlen:
+                self.dropped += 1
+            self.traverse.append((self.sequence, line))
+        else:
+            self.touch.append((self.sequence, line))
+        if not self.paused:
+            self.flush()
+
+    def flush(self):
+        traverse, touch = self.traverse, self.touch
+        while not self.paused and (traverse or touch):
+            if not touch or (traverse and traverse[0][0] < touch[0][0]):
+                _, line = traverse.popleft()
+            else:
+                _, line = touch.popleft()
+            self.sent += 1
+            self.transport.write(line)
+
+    def pauseProducing(self):
+        self.paused = True
+        self.paused_at = self.factory.clock.seconds()
+
+    def resumeProducing(self):
+        self.paused = False
+        self.paused_at = None
+        self.flush()
+
+    def idle(self, now):
+        """Seconds this client has been unable to drain its queue"""
+        return now - self.paused_at if self.paused else 0
+
+    def stopProducing(self):
+        self.paused = True
+        self.traverse.clear()
+        self.touch.clear()
 
 
 class PowerInspectFactory(Factory):
+    """Fans points out to the connected PowerInspect clients.
+
+    Connections are registered by peer address and removed when they
+    are lost. At most `max_clients` are accepted, and a client which has
+    been unable to drain its queue for `idle_timeout` seconds is
+    disconnected by a periodic reaper.
+    """
     log = Logger(namespace="PowerInspectFactory")
     connections = None
+    queue_size = 256
+    max_clients = 16
+    idle_timeout = 30
+    clock = reactor
 
     def __init__(self):
-        self.connections = []
+        self.connections = {}
+        self.reaper = None
 
     def buildProtocol(self, address):
         self.log.debug("build protocol for {}".format(address))
-        pi = PowerInspect(self)
-        self.connections.append(pi)
+        if len(self.connections) >= self.max_clients:
+            self.log.warn("refuse {}, already {} clients".format(address, len(self.connections)))
+            return None
+        pi = PowerInspect(self, address)
+        self.connections[address] = pi
         return pi
 
+    def removeConnection(self, connection):
+        if self.connections.get(connection.address) is connection:
+            del self.connections[connection.address]
+
+    def startFactory(self):
+        self.reaper = LoopingCall(self.reap)
+        self.reaper.clock = self.clock
+        self.reaper.start(self.idle_timeout, now=False)
+
     def stopFactory(self):
-        for connection in self.connections:
+        if self.reaper is not None and self.reaper.running:
+            self.reaper.stop()
+        self.reaper = None
+        for connection in self.connections.values():
             connection.transport.loseConnection()
-        self.connections[:] = []
+        self.connections.clear()
+
+    def reap(self):
+        now = self.clock.seconds()
+        for connection in self.connections.values():
+            if connection.idle(now) >= self.idle_timeout:
+                self.log.info("reaping idle client {}".format(connection.stats()))
+                self.removeConnection(connection)
+                connection.transport.abortConnection()
+
+    def stats(self):
+        return [connection.stats() for connection in self.connections.itervalues()]
 
     def send(self, data):
         self.log.debug("sending {} back to all clients".format(data))
-        for connection in self.connections:
-            connection.transport.write("{}\n".format(data))
+        line = "{}\n".format(data)
+        for connection in self.connections.itervalues():
+            connection.send(line)
 
 
 _server = None
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from math import sqrt
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class PollScheduler(object):
+    """Fixed rate poller keeping up to `window` reads in flight.
+
+    `poll` is called on every tick and must return a Deferred firing with
+    the response, `deliver` is called with every response in issue order.
+    Ticks are driven by a LoopingCall so the sample rate does not drift
+    with the round trip time. A tick that finds the window full is
+    skipped and counted. With an interval of 0 every completed read is
+    immediately replaced by a new one, so the stream runs at the limit of
+    the device.
+    """
+    log = Logger(namespace="PollScheduler")
+
+    def __init__(self, poll, deliver, interval, window=1, clock=reactor):
+        self.poll = poll
+        self.deliver = deliver
+        self.interval = interval
+        self.window = max(1, window)
+        self.clock = clock
+        self.loop = None
+        self.running = False
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.received = 0
+        self.failed = 0
+        self.skipped = 0
+        self.stale = 0
+        self._issued = 0
+        self._delivered = 0
+        self._started = None
+        self._last = None
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._started = self.clock.seconds()
+        if self.interval > 0:
+            self.loop = LoopingCall(self.tick)
+            self.loop.clock = self.clock
+            self.loop.start(self.interval, now=True)
+        else:
+            for _ in range(self.window):
+                self.tick()
+
+    def stop(self):
+        self.running = False
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.loop = None
+
+    def tick(self):
+        if not self.running:
+            return
+        if self.in_flight >= self.window:
+            self.skipped += 1
+            return
+        self.in_flight += 1
+        self.sent += 1
+        self._issued += 1
+        d = self.poll()
+        d.addCallbacks(self._on_response, self._on_failure,
+                       callbackArgs=(self._issued,))
+
+    def _refill(self):
+        if self.running and self.interval <= 0:
+            self.clock.callLater(0, self.tick)
+
+    def _on_response(self, response, seq):
+        self.in_flight -= 1
+        self.received += 1
+        self._refill()
+        if not self.running:
+            return
+        if seq < self._delivered:
+            self.stale += 1
+            return
+        self._delivered = seq
+        self._record(self.clock.seconds())
+        self.deliver(response)
+
+    def _on_failure(self, failure):
+        self.in_flight -= 1
+        self.failed += 1
+        self._refill()
+        self.log.error(str(failure))
+
+    def _record(self, now):
+        if self._last is not None:
+            delta = now - self._last
+            self._count += 1
+            diff = delta - self._mean
+            self._mean += diff / self._count
+            self._m2 += diff * (delta - self._mean)
+        self._last = now
+
+    @property
+    def rate(self):
+        """Achieved samples per second"""
+        return 1.0 / self._mean if self._mean > 0 else 0.0
+
+    @property
+    def jitter(self):
+        """Standard deviation of the interval between samples in seconds"""
+        return sqrt(self._m2 / self._count) if self._count else 0.0
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "stale": self.stale,
+            "in_flight": self.in_flight,
+            "rate": self.rate,
+            "jitter": self.jitter,
+        }
+
+
+class StallMonitor(object):
+    """Measures how late the reactor runs a call scheduled every `period`.
+
+    The lateness of each call is the time the reactor was unable to run
+    anything else, so `worst` is the worst-case reactor stall observed.
+    """
+
+    def __init__(self, period=0.01, clock=reactor):
+        self.period = period
+        self.clock = clock
+        self.call = None
+        self.reset()
+
+    def reset(self):
+        self.worst = 0.0
+        self.total = 0.0
+        self.count = 0
+        self._expected = None
+
+    def start(self):
+        if self.call is None:
+            self._schedule()
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def _schedule(self):
+        self._expected = self.clock.seconds() + self.period
+        self.call = self.clock.callLater(self.period, self._check)
+
+    def _check(self):
+        stall = max(0.0, self.clock.seconds() - self._expected)
+        self.worst = max(self.worst, stall)
+        self.total += stall
+        self.count += 1
+        self._schedule()
+
+    def stats(self):
+        return {
+            "worst": self.worst,
+            "mean": self.total / self.count if self.count else 0.0,
+            "samples": self.count,
+        }
@@ -8,6 +8,7 @@ from pymodbus.pdu import ModbusRequest
 from pymodbus.pdu import ModbusResponse
 from pymodbus.pdu import ModbusExceptions as merror
 from pymodbus.utilities import pack_bitstring, unpack_bitstring
+from pymodbus.utilities import BitVector
 
 
 class ReadBitsRequestBase(ModbusRequest):
@@ -48,9 +49,14 @@ class ReadBitsRequestBase(ModbusRequest):
 
 
 class ReadBitsResponseBase(ModbusResponse):
-    ''' Base class for Messages responding to bit-reading values '''
+    ''' Base class for Messages responding to bit-reading values
+
+    Set `compact` to True to decode the bits into a BitVector
+    instead of a list of booleans.
+    '''
 
     _rtu_byte_count_pos = 2
+    compact = False
 
     def __init__(self, values, **kwargs):
         ''' Initializes a new instance
@@ -75,7 +81,9 @@ class ReadBitsResponseBase(ModbusResponse):
         :param data: The packet data to decode
         '''
         self.byte_count = struct.unpack(">B", data[0])[0]
-        self.bits = unpack_bitstring(data[1:])
+        if self.compact:
+            self.bits = BitVector(data[1:])
+        else: self.bits = unpack_bitstring(data[1:])
 
     def setBit(self, address, value=1):
         ''' Helper function to set the specified bit
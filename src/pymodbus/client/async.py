@@ -32,9 +32,13 @@ Another example::
        reactor.callLater(1, process)
        reactor.run()
 """
-from twisted.internet import defer, protocol
+import heapq
+from collections import deque
+from twisted.internet import defer, protocol, reactor
+from pymodbus.constants import Defaults
 from pymodbus.factory import ClientDecoder
 from pymodbus.exceptions import ConnectionException
+from pymodbus.exceptions import TimeOutException
 from pymodbus.transaction import ModbusSocketFramer
 from pymodbus.transaction import FifoTransactionManager
 from pymodbus.transaction import DictTransactionManager
@@ -55,18 +59,60 @@ class ModbusClientProtocol(protocol.Protocol, ModbusClientMixin):
     '''
     This represents the base modbus client protocol.  All the application
     layer code is deferred to a higher level wrapper.
+
+    Every request must be answered within `timeout` seconds, otherwise it
+    is resent up to `retries` times before its deferred fails with a
+    TimeOutException. The deadlines of all the in-flight requests are
+    kept in a single heap served by one delayed call. Framers without
+    transaction ids (rtu, ascii, binary) are answered in order, so
+    their responses settle the oldest request in flight and a request
+    only times out once the ones sent before it were answered.
+
+    With dedup set, a read (function codes 1 to 4) identical to one
+    still in flight (same function, address, count and unit) is not
+    sent again, it gets the response of the read in flight. The
+    number of requests saved that way is counted in `saved`.
+
+    At most `window` requests are kept in flight, the requests made
+    while the window is full are queued locally (counted in `queued`)
+    and sent in order as the responses come in, ahead of any request
+    made meanwhile.
     '''
 
-    def __init__(self, framer=None):
+    clock = reactor
+    __reads = frozenset([1, 2, 3, 4])
+
+    def __init__(self, framer=None, **kwargs):
         ''' Initializes the framer module
 
         :param framer: The framer to use for the protocol
+        :param timeout: The seconds to wait for a response (0 disables)
+        :param retries: The number of times to resend a timed out request
+        :param dedup: True to share the response of identical reads in flight
+        :param window: The number of requests to keep in flight
         '''
         self._connected = False
         self.framer = framer or ModbusSocketFramer(ClientDecoder())
+        window = kwargs.get('window', Defaults.Window)
         if isinstance(self.framer, ModbusSocketFramer):
-            self.transaction = DictTransactionManager(self)
-        else: self.transaction = FifoTransactionManager(self)
+            self.transaction = DictTransactionManager(self, window)
+        else: self.transaction = FifoTransactionManager(self, window)
+        self._backlog = deque()
+        self.timeout = kwargs.get('timeout', Defaults.Timeout)
+        self.retries = kwargs.get('retries', 0)
+        self.dedup = kwargs.get('dedup', False)
+        self._flights = {}
+        self._deadlines = []
+        self._pending = {}
+        self._order = deque()
+        self._expired = {}
+        self._timer = None
+        self.timeouts = 0
+        self.retried = 0
+        self.late = 0
+        self.unrequested = 0
+        self.saved = 0
+        self.queued = 0
 
     def connectionMade(self):
         ''' Called upon a successful client connection.
@@ -81,9 +127,16 @@ class ModbusClientProtocol(protocol.Protocol, ModbusClientMixin):
         '''
         _logger.debug("Client disconnected from modbus server: %s" % reason)
         self._connected = False
+        self._cancelTimer()
+        self._deadlines = []
+        self._pending.clear()
+        self._order.clear()
         for tid in self.transaction:
             self.transaction.getTransaction(tid).errback(Failure(
                 ConnectionException('Connection lost during request')))
+        while self._backlog:
+            self._backlog.popleft()[1].errback(Failure(
+                ConnectionException('Connection lost during request')))
 
     def dataReceived(self, data):
         ''' Get response, check for valid message, decode result
@@ -96,10 +149,65 @@ class ModbusClientProtocol(protocol.Protocol, ModbusClientMixin):
         ''' Starts the producer to send the next request to
         consumer.write(Frame(request))
         '''
+        key = None
+        if self.dedup and request.function_code in self.__reads:
+            key = (request.function_code, request.address,
+                request.count, request.unit_id)
+            waiters = self._flights.get(key)
+            if waiters is not None:
+                self.saved += 1
+                waiter = defer.Deferred()
+                waiters.append(waiter)
+                return waiter
+        if self._connected and (self._backlog or
+                len(self.transaction) >= self.transaction.window):
+            self.queued += 1
+            response = defer.Deferred()
+            self._backlog.append((request, response))
+        else: response = self._sendRequest(request)
+        if key is not None and self._connected:
+            self._flights[key] = waiters = []
+            response.addBoth(self._land, key, waiters)
+        return response
+
+    def _sendRequest(self, request):
+        ''' Sends a request and tracks its response
+
+        :param request: The request to send
+        :returns: The deferred of the response
+        '''
         request.transaction_id = self.transaction.getNextTID()
         packet = self.framer.buildPacket(request)
         self.transport.write(packet)
-        return self._buildResponse(request.transaction_id)
+        response = self._buildResponse(request.transaction_id)
+        if self._connected:
+            if isinstance(self.transaction, FifoTransactionManager):
+                self._order.append(request.transaction_id)
+            self._expired.pop(request.transaction_id, None)
+            self._addDeadline(request.transaction_id, packet, self.retries)
+        return response
+
+    def _drain(self):
+        ''' Sends the queued requests while the window has room '''
+        while self._backlog and self._connected and \
+                len(self.transaction) < self.transaction.window:
+            request, response = self._backlog.popleft()
+            self._sendRequest(request).chainDeferred(response)
+
+    def _land(self, result, key, waiters):
+        ''' Hands the result of a read to the identical reads
+        that waited on it.
+
+        :param result: The response or failure of the read
+        :param key: The key of the read
+        :param waiters: The deferreds of the identical reads
+        '''
+        if self._flights.get(key) is waiters:
+            del self._flights[key]
+        for waiter in waiters:
+            if isinstance(result, Failure): waiter.errback(result)
+            else: waiter.callback(result)
+        return result
 
     def _handleResponse(self, reply):
         ''' Handle the processed response and link to correct deferred
@@ -108,10 +216,20 @@ class ModbusClientProtocol(protocol.Protocol, ModbusClientMixin):
         '''
         if reply is not None:
             tid = reply.transaction_id
+            if self._order: tid = self._order.popleft()
             handler = self.transaction.getTransaction(tid)
             if handler:
+                self._pending.pop(tid, None)
                 handler.callback(reply)
-            else: _logger.debug("Unrequested message: " + str(reply))
+                if self._backlog: self._drain()
+            elif tid in self._expired:
+                self.late += 1
+                self._expired[tid] -= 1
+                if not self._expired[tid]: del self._expired[tid]
+                _logger.debug("Late message: " + str(reply))
+            else:
+                self.unrequested += 1
+                _logger.debug("Unrequested message: " + str(reply))
 
     def _buildResponse(self, tid):
         ''' Helper method to return a deferred response
@@ -129,12 +247,67 @@ class ModbusClientProtocol(protocol.Protocol, ModbusClientMixin):
         return d
 
     #----------------------------------------------------------------------#
-    # Extra Functions
+    # Request Timeouts
     #----------------------------------------------------------------------#
-    #if send_failed:
-    #       if self.retry > 0:
-    #               deferLater(clock, self.delay, send, message)
-    #               self.retry -= 1
+    def _addDeadline(self, tid, packet, retries):
+        ''' Track the deadline of an in-flight request
+
+        :param tid: The transaction identifier of the request
+        :param packet: The packet to resend on timeout
+        :param retries: The number of resends left
+        '''
+        if not self.timeout: return
+        entry = (self.clock.seconds() + self.timeout, tid, packet, retries)
+        self._pending[tid] = entry
+        heapq.heappush(self._deadlines, entry)
+        if self._deadlines[0] is entry:
+            self._cancelTimer()
+            self._timer = self.clock.callLater(self.timeout, self._expire)
+
+    def _cancelTimer(self):
+        ''' Cancel the pending timeout check if any '''
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+
+    def _expire(self):
+        ''' Fail or resend every request past its deadline and rearm
+        the timer for the next one. Entries of answered requests are
+        discarded lazily here.
+
+        Every copy of a request which may still be answered after its
+        transaction settled is counted in _expired, so the replies to
+        the resent or timed out copies are counted as late.
+        '''
+        self._timer = None
+        now = self.clock.seconds()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            entry = heapq.heappop(self._deadlines)
+            deadline, tid, packet, retries = entry
+            if self._pending.get(tid) is not entry: continue
+            if self._order and self._order[0] != tid:
+                # answered in order, wait for the requests sent before
+                self._addDeadline(tid, packet, retries)
+                continue
+            if retries > 0 and self._connected:
+                _logger.debug("Resending timed out transaction %d" % tid)
+                self.retried += 1
+                self._expired[tid] = self._expired.get(tid, 0) + 1
+                self.transport.write(packet)
+                self._addDeadline(tid, packet, retries - 1)
+                continue
+            del self._pending[tid]
+            if self._order: self._order.popleft()
+            self.timeouts += 1
+            self._expired[tid] = self._expired.get(tid, 0) + 1
+            handler = self.transaction.getTransaction(tid)
+            if handler:
+                handler.errback(Failure(
+                    TimeOutException('No response to transaction %d' % tid)))
+        if self._backlog: self._drain()
+        if self._deadlines and self._timer is None:
+            delay = max(0, self._deadlines[0][0] - now)
+            self._timer = self.clock.callLater(delay, self._expire)
 
 
 #---------------------------------------------------------------------------#
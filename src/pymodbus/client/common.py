@@ -13,6 +13,7 @@ from pymodbus.register_write_message import *
 from pymodbus.diag_message import *
 from pymodbus.file_message import *
 from pymodbus.other_message import *
+from pymodbus.exceptions import ParameterException
 
 
 class ModbusClientMixin(object):
@@ -132,7 +133,130 @@ class ModbusClientMixin(object):
         request = ReadWriteMultipleRegistersRequest(*args, **kwargs)
         return self.execute(request)
 
+    def read_tags(self, tags, gap=0, **kwargs):
+        ''' Reads a set of tags with as few requests as possible,
+        see ModbusReadPlanner.
+
+        :param tags: The (function code, address, count) tags to read
+        :param gap: The unused addresses a request may read between tags
+        :param unit: The slave unit this request is targeting
+        :returns: A dict of tag to values (or a deferred of it)
+        '''
+        return ModbusReadPlanner(tags, gap).execute(self, **kwargs)
+
+
+#---------------------------------------------------------------------------#
+# Read Planner
+#---------------------------------------------------------------------------#
+class ModbusReadPlanner(object):
+    '''
+    Plans the reads of a set of tags so they take the fewest
+    requests. A tag is a (function code, address, count) tuple for
+    the read functions 1 to 4::
+
+        planner = ModbusReadPlanner([(3, 0, 2), (3, 4, 2), (1, 10, 1)], gap=4)
+        values = planner.execute(client)
+        values[(3, 4, 2)]  # the two registers of the tag
+
+    Tags of one table are merged into a request as long as the
+    request stays within the protocol limit (125 registers or 2000
+    bits) and the unused addresses between two tags do not exceed
+    gap. A larger gap saves round trips at the cost of reading
+    values nobody asked for (and fails if a gap hits an address the
+    slave does not have). The plan is computed once, so keep the
+    planner around to poll the same tags again.
+    '''
+
+    __requests = {
+        1: ReadCoilsRequest,
+        2: ReadDiscreteInputsRequest,
+        3: ReadHoldingRegistersRequest,
+        4: ReadInputRegistersRequest,
+    }
+    __limits = { 1: 2000, 2: 2000, 3: 125, 4: 125 }
+
+    def __init__(self, tags, gap=0):
+        ''' Initializes and computes the plan
+
+        :param tags: The (function code, address, count) tags to read
+        :param gap: The unused addresses a request may read between tags
+        '''
+        self.gap = gap
+        self.tags = sorted(set(tags))
+        self.plan = self.__build()
+
+    def __build(self):
+        ''' Merges the sorted tags into requests
+
+        :returns: A list of ((fx, address, count), [tags]) entries
+        '''
+        plan = []
+        for tag in self.tags:
+            fx, address, count = tag
+            if fx not in self.__limits:
+                raise ParameterException("cannot plan function %d" % fx)
+            if not 0 < count <= self.__limits[fx]:
+                raise ParameterException("tag %s exceeds the request limit" % (tag,))
+            if plan:
+                (last, start, size), members = plan[-1]
+                end = max(start + size, address + count)
+                if last == fx and address - (start + size) <= self.gap \
+                        and end - start <= self.__limits[fx]:
+                    plan[-1] = ((fx, start, end - start), members + [tag])
+                    continue
+            plan.append((tag, [tag]))
+        return plan
+
+    def requests(self, **kwargs):
+        ''' Builds the requests of the plan
+
+        :param unit: The slave unit the requests are targeting
+        :returns: A list of the read requests
+        '''
+        return [self.__requests[fx](address, count, **kwargs)
+            for (fx, address, count), _ in self.plan]
+
+    def scatter(self, responses):
+        ''' Splits the responses to the requests back into tags
+
+        A tag whose request failed gets the error response instead
+        of its values.
+
+        :param responses: The responses in the order of the requests
+        :returns: A dict of tag to values
+        '''
+        values = {}
+        for ((fx, start, _), tags), response in zip(self.plan, responses):
+            if getattr(response, 'function_code', 0x80) >= 0x80:
+                values.update((tag, response) for tag in tags)
+                continue
+            data = response.bits if fx in (1, 2) else response.registers
+            for tag in tags:
+                offset = tag[1] - start
+                values[tag] = data[offset:offset + tag[2]]
+        return values
+
+    def execute(self, client, **kwargs):
+        ''' Reads the tags with the client, an asynchronous client
+        gets all the requests at once.
+
+        :param client: The client to read with
+        :param unit: The slave unit the requests are targeting
+        :returns: A dict of tag to values (or a deferred of it)
+        '''
+        responses = [client.execute(request)
+            for request in self.requests(**kwargs)]
+        if responses and hasattr(responses[0], 'addCallback'):
+            from twisted.internet import defer
+            deferred = defer.gatherResults(responses, consumeErrors=True)
+            return deferred.addCallback(self.scatter)
+        return self.scatter(responses)
+
+    def __len__(self):
+        ''' Returns the number of requests of the plan '''
+        return len(self.plan)
+
 #---------------------------------------------------------------------------#
 # Exported symbols
 #---------------------------------------------------------------------------#
-__all__ = [ 'ModbusClientMixin' ]
+__all__ = [ 'ModbusClientMixin', 'ModbusReadPlanner' ]
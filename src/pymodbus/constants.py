@@ -70,6 +70,11 @@ class Defaults(Singleton):
 
        The number of bits sent after each character in a message to
        indicate the end of the byte.  This defaults to 1.
+
+    .. attribute:: Window
+
+       The number of requests a client keeps in flight before it
+       queues new ones locally (128).
     '''
     Port          = 502
     Retries       = 3
@@ -82,6 +87,7 @@ class Defaults(Singleton):
     Parity        = 'N'
     Bytesize      = 8
     Stopbits      = 1
+    Window        = 128
 
 
 class ModbusStatus(Singleton):
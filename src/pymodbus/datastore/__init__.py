@@ -1,6 +1,11 @@
 from pymodbus.datastore.store import ModbusSequentialDataBlock
 from pymodbus.datastore.store import ModbusSparseDataBlock
+from pymodbus.datastore.store import ModbusRegisterDataBlock
+from pymodbus.datastore.store import ModbusBitDataBlock
+from pymodbus.datastore.store import ModbusPagedDataBlock
+from pymodbus.datastore.mapped import ModbusMappedDataBlock
 from pymodbus.datastore.context import ModbusSlaveContext
+from pymodbus.datastore.context import ModbusVersionedSlaveContext
 from pymodbus.datastore.context import ModbusServerContext
 
 #---------------------------------------------------------------------------#
@@ -8,5 +13,8 @@ from pymodbus.datastore.context import ModbusServerContext
 #---------------------------------------------------------------------------#
 __all__ = [
     "ModbusSequentialDataBlock", "ModbusSparseDataBlock",
-    "ModbusSlaveContext", "ModbusServerContext",
+    "ModbusRegisterDataBlock", "ModbusBitDataBlock",
+    "ModbusPagedDataBlock", "ModbusMappedDataBlock",
+    "ModbusSlaveContext", "ModbusVersionedSlaveContext",
+    "ModbusServerContext",
 ]
@@ -1,3 +1,6 @@
+import time
+import threading
+from bisect import bisect_left, bisect_right
 from pymodbus.exceptions import ParameterException
 from pymodbus.interfaces import IModbusSlaveContext
 from pymodbus.datastore.store import ModbusSequentialDataBlock
@@ -10,6 +13,91 @@ import logging;
 _logger = logging.getLogger(__name__)
 
 
+#---------------------------------------------------------------------------#
+# Change Notification
+#---------------------------------------------------------------------------#
+class ModbusSubscriptionIndex(object):
+    '''
+    An interval index of the callbacks subscribed to ranges of one
+    table. The subscribed ranges split the address space into
+    segments and each segment stores the subscribers covering it,
+    so finding the subscribers of a write is a bisect plus a walk
+    over the few segments the write spans, independent of the
+    number of subscribers. The index is rebuilt when subscriptions
+    change and swapped in as a whole, so lookups need no lock.
+    '''
+
+    def __init__(self):
+        ''' Initializes an empty index '''
+        self.__ranges = {}
+        self.__handle = 0
+        self.__index = ([], [], [], {})
+
+    def __len__(self):
+        ''' Returns the number of subscriptions in the index '''
+        return len(self.__ranges)
+
+    def add(self, address, count, callback):
+        ''' Subscribes a callback to a range of addresses
+
+        :param address: The starting address
+        :param count: The number of addresses to watch
+        :param callback: The callback to add
+        :returns: The handle of the subscription
+        '''
+        if count < 1:
+            raise ParameterException("subscription count must be positive")
+        self.__handle += 1
+        self.__ranges[self.__handle] = (address, address + count, callback)
+        self.__build()
+        return self.__handle
+
+    def remove(self, handle):
+        ''' Removes a subscription from the index
+
+        :param handle: The handle returned by add
+        '''
+        if self.__ranges.pop(handle, None) is not None:
+            self.__build()
+
+    def __build(self):
+        ''' Rebuilds the segment index from the subscribed ranges '''
+        starts, ends, callbacks = {}, {}, {}
+        for handle, (start, end, callback) in self.__ranges.iteritems():
+            callbacks[handle] = callback
+            starts.setdefault(start, []).append(handle)
+            ends.setdefault(end, []).append(handle)
+        bounds = sorted(set(starts) | set(ends))
+        handles, segments, active = [], [], set()
+        for bound in bounds:
+            active.difference_update(ends.get(bound, ()))
+            active.update(starts.get(bound, ()))
+            handles.append(tuple(sorted(active)))
+            segments.append(tuple(callbacks[handle]
+                for handle in handles[-1]))
+        self.__index = (bounds, handles, segments, callbacks)
+
+    def match(self, address, count=1):
+        ''' Returns the callbacks subscribed to any address of a range
+
+        A callback comes up once per subscription matching the range,
+        so a callback subscribed twice to the range is returned twice.
+
+        :param address: The starting address
+        :param count: The number of addresses written
+        :returns: The matching callbacks in subscription order
+        '''
+        bounds, handles, segments, callbacks = self.__index
+        first = max(bisect_right(bounds, address) - 1, 0)
+        last = bisect_left(bounds, address + count)
+        if last - first <= 1:
+            return segments[first] if first < last else ()
+        matched = set()
+        for segment in handles[first:last]:
+            matched.update(segment)
+        return [callbacks[handle] for handle in sorted(matched)]
+
+
 #---------------------------------------------------------------------------#
 # Slave Contexts
 #---------------------------------------------------------------------------#
@@ -21,7 +109,10 @@ class ModbusSlaveContext(IModbusSlaveContext):
 
     def __init__(self, *args, **kwargs):
         ''' Initializes the datastores, defaults to fully populated
-        sequential data blocks if none are passed in.
+        sequential data blocks if none are passed in. Pass packed
+        ModbusBitDataBlock and ModbusRegisterDataBlock blocks to save
+        memory, their getValues return a BitVector and an array('H')
+        instead of lists.
 
         :param kwargs: Each element is a ModbusDataBlock
 
@@ -31,10 +122,11 @@ class ModbusSlaveContext(IModbusSlaveContext):
             'ir' - Input Registers iniatializer
         '''
         self.store = {}
-        self.store['d'] = kwargs.get('di', ModbusSequentialDataBlock.create())
-        self.store['c'] = kwargs.get('co', ModbusSequentialDataBlock.create())
-        self.store['i'] = kwargs.get('ir', ModbusSequentialDataBlock.create())
-        self.store['h'] = kwargs.get('hr', ModbusSequentialDataBlock.create())
+        self.store['d'] = kwargs['di'] if 'di' in kwargs else ModbusSequentialDataBlock.create()
+        self.store['c'] = kwargs['co'] if 'co' in kwargs else ModbusSequentialDataBlock.create()
+        self.store['i'] = kwargs['ir'] if 'ir' in kwargs else ModbusSequentialDataBlock.create()
+        self.store['h'] = kwargs['hr'] if 'hr' in kwargs else ModbusSequentialDataBlock.create()
+        self.subscriptions = dict((key, ModbusSubscriptionIndex()) for key in self.store)
 
     def __str__(self):
         ''' Returns a string representation of the context
@@ -82,6 +174,130 @@ class ModbusSlaveContext(IModbusSlaveContext):
         address = address + 1  # section 4.4 of specification
         _logger.debug("setValues[%d] %d:%d" % (fx, address, len(values)))
         self.store[self.decode(fx)].setValues(address, values)
+        self.notify(fx, address - 1, values)
+
+    def subscribe(self, fx, address, count, callback):
+        ''' Calls back when a write touches a range of a table
+
+        The callback is called once per write and subscription with
+        the function code, starting address and all the values of the
+        write::
+
+            def changed(fx, address, values): pass
+            handle = context.subscribe(3, 0x10, 8, changed)
+
+        :param fx: The function (table) to watch
+        :param address: The starting address to watch
+        :param count: The number of addresses to watch
+        :param callback: The callback to call on a change
+        :returns: A handle to pass to unsubscribe
+        '''
+        key = self.decode(fx)
+        return (key, self.subscriptions[key].add(address, count, callback))
+
+    def unsubscribe(self, handle):
+        ''' Removes a subscription made with subscribe
+
+        :param handle: The handle returned by subscribe
+        '''
+        key, handle = handle
+        self.subscriptions[key].remove(handle)
+
+    def notify(self, fx, address, values):
+        ''' Calls the callbacks subscribed to a written range
+
+        :param fx: The function we are working with
+        :param address: The starting address
+        :param values: The values that were written
+        '''
+        index = self.subscriptions[self.decode(fx)]
+        if not len(index): return
+        for callback in index.match(address, len(values)):
+            try: callback(fx, address, values)
+            except Exception, ex:
+                _logger.error("subscriber failed: %s" % ex)
+
+
+class ModbusVersionedSlaveContext(ModbusSlaveContext):
+    '''
+    This creates a modbus data model whose reads are consistent
+    snapshots while other threads write to it (threaded servers).
+
+    Each table is guarded by a sequence lock: writers are serialized
+    by a per table mutex and bump the table version before and after
+    writing, readers take no lock and retry if the version was odd or
+    changed while they copied the values. After `spins` retries a
+    reader takes the mutex to guarantee progress.
+    '''
+
+    spins = 64
+
+    def __init__(self, *args, **kwargs):
+        ''' Initializes the datastores, see ModbusSlaveContext
+
+        :param kwargs: Each element is a ModbusDataBlock
+        '''
+        ModbusSlaveContext.__init__(self, *args, **kwargs)
+        self.__locks = dict((key, threading.Lock()) for key in self.store)
+        self.__versions = dict.fromkeys(self.store, 0)
+
+    def __str__(self):
+        ''' Returns a string representation of the context
+
+        :returns: A string representation of the context
+        '''
+        return "Modbus Versioned Slave Context"
+
+    def version(self, fx):
+        ''' Returns the current version of a table, it is odd
+        while a write is in progress.
+
+        :param fx: The function we are working with
+        :returns: The version of the table
+        '''
+        return self.__versions[self.decode(fx)]
+
+    def reset(self):
+        ''' Resets all the datastores to their default values '''
+        for key, datastore in self.store.iteritems():
+            with self.__locks[key]:
+                self.__versions[key] += 1
+                try: datastore.reset()
+                finally: self.__versions[key] += 1
+
+    def getValues(self, fx, address, count=1):
+        ''' Returns a consistent copy of the requested values
+
+        :param fx: The function we are working with
+        :param address: The starting address
+        :param count: The number of values to retrieve
+        :returns: The requested values from a:a+c
+        '''
+        key, versions = self.decode(fx), self.__versions
+        for _ in xrange(self.spins):
+            version = versions[key]
+            if not version & 1:
+                values = ModbusSlaveContext.getValues(self, fx, address, count)
+                if versions[key] == version:
+                    return values
+            time.sleep(0)
+        with self.__locks[key]:
+            return ModbusSlaveContext.getValues(self, fx, address, count)
+
+    def setValues(self, fx, address, values):
+        ''' Sets the datastore with the supplied values
+
+        :param fx: The function we are working with
+        :param address: The starting address
+        :param values: The new values to be set
+        '''
+        key = self.decode(fx)
+        _logger.debug("setValues[%d] %d:%d" % (fx, address + 1, len(values)))
+        with self.__locks[key]:
+            self.__versions[key] += 1
+            try: self.store[key].setValues(address + 1, values)
+            finally: self.__versions[key] += 1
+        self.notify(fx, address, values) # outside the lock, may read back
 
 
 class ModbusServerContext(object):
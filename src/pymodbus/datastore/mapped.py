@@ -0,0 +1,226 @@
+'''
+Memory Mapped Datastore
+-------------------------
+
+A datastore block kept in a memory mapped file. The register image
+survives restarts and can be read by other processes (more server
+workers, an analytics process, ...) without a modbus round trip.
+
+File Layout
+-------------------------
+
+The file starts with a 32 byte big endian header followed by the
+values::
+
+    [ magic ][ version ][ kind ][ reserved ][ address ][ count ][ pad ]
+      4s       B          B       H            I          I        16x
+
+* magic is 'PMDB' and version is 1
+* kind is 0 for registers and 1 for bits
+* registers are stored as big endian 16 bit words (the wire format)
+* bits are packed eight per byte, least significant bit first
+
+Writes land in the shared mapping and are visible to the other
+processes right away. Flushing the mapping to disk (msync) is only
+done when `flush_interval` seconds passed since the last flush, on
+an explicit flush() and on close().
+'''
+import os
+import sys
+import mmap
+import time
+import struct
+from array import array
+from pymodbus.utilities import BitVector
+from pymodbus.exceptions import ParameterException
+from pymodbus.datastore.store import BaseModbusDataBlock
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Datablock Storage
+#---------------------------------------------------------------------------#
+class ModbusMappedDataBlock(BaseModbusDataBlock):
+    ''' Creates a modbus datastore backed by a memory mapped file
+
+    Only one process should write to a given file, any number of
+    processes may open it with readonly set to read it::
+
+        block = ModbusMappedDataBlock('/var/lib/modbus/hr.db')
+        image = ModbusMappedDataBlock('/var/lib/modbus/hr.db', readonly=True)
+    '''
+
+    MAGIC   = 'PMDB'
+    VERSION = 1
+    REGISTERS, BITS = 0, 1
+    __header = struct.Struct('>4sBBHII16x')
+    __swap   = sys.byteorder == 'little'
+
+    def __init__(self, path, address=0x00, count=65536, bits=False,
+                 readonly=False, flush_interval=1.0):
+        ''' Opens or creates the mapped datastore
+
+        The address, count and bits arguments are only used when
+        the file is created, an existing file must match them.
+
+        :param path: The file to map
+        :param address: The starting address of the datastore
+        :param count: The number of values in the datastore
+        :param bits: True to store bits instead of registers
+        :param readonly: True to map an existing file read only
+        :param flush_interval: Minimum seconds between flushes (None never)
+        '''
+        self.path = path
+        self.readonly = readonly
+        self.flush_interval = flush_interval
+        self.default_value = False if bits else 0
+        if not os.path.exists(path):
+            if readonly:
+                raise ParameterException("%s does not exist" % path)
+            self.__create(path, address, count, bits)
+        mode = os.O_RDONLY if readonly else os.O_RDWR
+        fd = os.open(path, mode)
+        try:
+            access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+            self.__map = mmap.mmap(fd, 0, access=access)
+        finally: os.close(fd)
+        self.__load(address, count, bits)
+        self.__dirty = False
+        self.__flushed = time.time()
+
+    def __create(self, path, address, count, bits):
+        ''' Writes a new zeroed datastore file '''
+        size = (count + 7) // 8 if bits else count * 2
+        kind = self.BITS if bits else self.REGISTERS
+        with open(path, 'wb') as handle:
+            handle.write(self.__header.pack(self.MAGIC, self.VERSION, kind,
+                0, address, count))
+            handle.truncate(self.__header.size + size)
+
+    def __load(self, address, count, bits):
+        ''' Checks the header of the mapped file '''
+        magic, version, kind, _, self.address, self.count = \
+            self.__header.unpack_from(self.__map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ParameterException("%s is not a datastore file" % self.path)
+        self.bits = (kind == self.BITS)
+        if not self.readonly and (self.bits != bits or
+                (self.address, self.count) != (address, count)):
+            raise ParameterException("%s layout does not match" % self.path)
+        self.offset = self.__header.size
+
+    def validate(self, address, count=1):
+        ''' Checks to see if the request is in range
+
+        :param address: The starting address
+        :param count: The number of values to test for
+        :returns: True if the request in within range, False otherwise
+        '''
+        return self.address <= address and \
+            address + count <= self.address + self.count
+
+    def getValues(self, address, count=1):
+        ''' Returns the requested values of the datastore
+
+        :param address: The starting address
+        :param count: The number of values to retrieve
+        :returns: The requested values from a:a+c
+        '''
+        start = address - self.address
+        if self.bits:
+            first = self.offset + (start >> 3)
+            chunk = self.__map[first:self.offset + ((start + count + 7) >> 3)]
+            return BitVector(chunk).extract(start & 7, count)
+        first = self.offset + start * 2
+        values = array('H', self.__map[first:first + count * 2])
+        if self.__swap: values.byteswap()
+        return values
+
+    def setValues(self, address, values):
+        ''' Sets the requested values of the datastore
+
+        :param address: The starting address
+        :param values: The new values to be set
+        '''
+        if not isinstance(values, (list, array, BitVector)):
+            values = [values]
+        start = address - self.address
+        if self.bits:
+            first = self.offset + (start >> 3)
+            last = self.offset + ((start + len(values) + 7) >> 3)
+            chunk = BitVector(self.__map[first:last])
+            chunk.assign(start & 7, values)
+            self.__map[first:last] = chunk.tostring()
+        else:
+            packed = array('H', values)
+            if self.__swap: packed.byteswap()
+            first = self.offset + start * 2
+            self.__map[first:first + len(packed) * 2] = packed.tostring()
+        self.__dirty = True
+        if self.flush_interval is not None and \
+                time.time() - self.__flushed >= self.flush_interval:
+            self.flush()
+
+    def default(self, count, value=False):
+        ''' Used to initialize a store to one value
+
+        The layout of the file is fixed when it is created, so the
+        count must match it.
+
+        :param count: The number of fields to set
+        :param value: The default value to set to the fields
+        '''
+        if count != self.count:
+            raise ParameterException("%s holds %d values, not %d" % (
+                self.path, self.count, count))
+        self.default_value = bool(value) if self.bits else int(value)
+        self.reset()
+
+    def reset(self):
+        ''' Resets the datastore to the initialized default value '''
+        if self.bits:
+            fill = '\xff' if self.default_value else '\x00'
+            image = BitVector(fill * ((self.count + 7) // 8), self.count)
+            image = image.tostring()
+        else:
+            image = array('H', [self.default_value]) * self.count
+            if self.__swap: image.byteswap()
+            image = image.tostring()
+        self.__map[self.offset:self.offset + len(image)] = image
+        self.__dirty = True
+
+    def flush(self):
+        ''' Flushes the pending changes of the mapping to disk '''
+        if self.__dirty and not self.readonly:
+            self.__map.flush()
+        self.__dirty = False
+        self.__flushed = time.time()
+
+    def close(self):
+        ''' Flushes and unmaps the datastore file '''
+        self.flush()
+        self.__map.close()
+
+    def __iter__(self):
+        ''' Iterater over the data block data
+
+        :returns: An iterator of the data block data
+        '''
+        return enumerate(self.getValues(self.address, self.count), self.address)
+
+    def __str__(self):
+        ''' Build a representation of the datastore
+
+        :returns: A string representation of the datastore
+        '''
+        return "MappedDataStore(%s, %d)" % (self.path, self.count)
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [ "ModbusMappedDataBlock" ]
@@ -1,5 +1,7 @@
+import time
 from pymodbus.exceptions import NotImplementedException
 from pymodbus.interfaces import IModbusSlaveContext
+from pymodbus.pdu import ModbusResponse
 
 #---------------------------------------------------------------------------#
 # Logging
@@ -12,17 +14,40 @@ _logger = logging.getLogger(__name__)
 # Context
 #---------------------------------------------------------------------------#
 class RemoteSlaveContext(IModbusSlaveContext):
-    ''' TODO
+    '''
     This creates a modbus data model that connects to
     a remote device (depending on the client used)
+
+    With a synchronous client the values are returned directly,
+    with an asynchronous (twisted) client every method returns a
+    Deferred of the value instead, which the twisted server waits
+    for without blocking its other clients.
+
+    Given a ttl the context acts as a caching gateway: the values
+    read from the remote device are reused for ttl seconds (or the
+    ttl set for their range with setTtl), so validate and getValues
+    of a request cost one remote read and many clients polling the
+    same ranges share one poll stream. With an asynchronous client,
+    identical reads arriving while one is in flight wait for its
+    result instead of reading again. Writes go straight to the
+    device and drop the cached values they overlap.
     '''
 
-    def __init__(self, client):
+    def __init__(self, client, ttl=None):
         ''' Initializes the datastores
 
         :param client: The client to retrieve values with
+        :param ttl: The seconds to cache read values (None disables)
         '''
         self._client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.__cache = dict((key, {}) for key in 'dchi')
+        self.__ttls = dict((key, []) for key in 'dchi')
+        self.__generation = dict.fromkeys('dchi', 0)
+        self.__flights = {}
         self.__build_mapping()
 
     def reset(self):
@@ -38,8 +63,8 @@ class RemoteSlaveContext(IModbusSlaveContext):
         :returns: True if the request in within range, False otherwise
         '''
         _logger.debug("validate[%d] %d:%d" % (fx, address, count))
-        result = self.__get_callbacks[self.decode(fx)](address, count)
-        return result.function_code < 0x80
+        result = self.__fetch(self.decode(fx), address, count)
+        return self.__resolve(result, lambda r: not isinstance(r, ModbusResponse))
 
     def getValues(self, fx, address, count=1):
         ''' Validates the request to make sure it is in range
@@ -49,10 +74,8 @@ class RemoteSlaveContext(IModbusSlaveContext):
         :param count: The number of values to retrieve
         :returns: The requested values from a:a+c
         '''
-        # TODO deal with deferreds
         _logger.debug("get values[%d] %d:%d" % (fx, address, count))
-        result = self.__get_callbacks[self.decode(fx)](address, count)
-        return self.__extract_result(self.decode(fx), result)
+        return self.__fetch(self.decode(fx), address, count)
 
     def setValues(self, fx, address, values):
         ''' Sets the datastore with the supplied values
@@ -61,9 +84,23 @@ class RemoteSlaveContext(IModbusSlaveContext):
         :param address: The starting address
         :param values: The new values to be set
         '''
-        # TODO deal with deferreds
         _logger.debug("set values[%d] %d:%d" % (fx, address, len(values)))
-        self.__set_callbacks[self.decode(fx)](address, values)
+        key = self.decode(fx)
+        self.__invalidate(key, address, len(values))
+        result = self.__set_callbacks[key](address, values)
+        return self.__resolve(result,
+            lambda r: self.__invalidate(key, address, len(values)))
+
+    def setTtl(self, fx, address, count, ttl):
+        ''' Sets the cache ttl of a range of a table, the first
+        range set that covers a read decides its ttl.
+
+        :param fx: The function (table) of the range
+        :param address: The starting address of the range
+        :param count: The number of addresses in the range
+        :param ttl: The seconds to cache the values (0 disables)
+        '''
+        self.__ttls[self.decode(fx)].append((address, address + count, ttl))
 
     def __str__(self):
         ''' Returns a string representation of the context
@@ -90,6 +127,135 @@ class RemoteSlaveContext(IModbusSlaveContext):
             'i': lambda a, v: self._client.write_registers(a, v),
         }
 
+    def __fetch(self, key, address, count):
+        ''' Reads a range from the cache or the remote device
+
+        :param key: The table to read from
+        :param address: The starting address
+        :param count: The number of values to read
+        :returns: The values (or error response), or a Deferred of them
+        '''
+        extract = lambda r: self.__extract_result(key, r)
+        if self.ttl is None:
+            result = self.__get_callbacks[key](address, count)
+            return self.__resolve(result, extract)
+        values = self.__lookup(key, address, count)
+        if values is not None:
+            self.hits += 1
+            return values
+        waiters = self.__flights.get((key, address, count))
+        if waiters is not None:
+            self.coalesced += 1
+            return self.__join(waiters)
+        self.misses += 1
+        generation = self.__generation[key]
+        result = self.__get_callbacks[key](address, count)
+        if not hasattr(result, 'addCallback'):
+            return self.__store(extract(result), key, address, count, generation)
+        waiters = self.__flights[(key, address, count)] = []
+        result.addCallback(extract)
+        result.addCallback(self.__store, key, address, count, generation)
+        result.addBoth(self.__land, key, address, count, waiters)
+        return self.__join(waiters)
+
+    def __join(self, waiters):
+        ''' Returns a Deferred of the result of a read in flight
+
+        :param waiters: The Deferreds waiting on the read
+        '''
+        from twisted.internet import defer
+        waiter = defer.Deferred()
+        waiters.append(waiter)
+        return waiter
+
+    def __land(self, result, key, address, count, waiters):
+        ''' Hands the result of a read to all its waiters
+
+        :param result: The values read or the failure of the read
+        :param waiters: The Deferreds waiting on the read
+        '''
+        if self.__flights.get((key, address, count)) is waiters:
+            del self.__flights[(key, address, count)]
+        failed = hasattr(result, 'raiseException')
+        for waiter in waiters:
+            if failed: waiter.errback(result)
+            else: waiter.callback(result)
+
+    def __lookup(self, key, address, count):
+        ''' Returns the cached values of a range if still fresh
+
+        :param key: The table to read from
+        :param address: The starting address
+        :param count: The number of values to read
+        :returns: The values or None if they are not cached
+        '''
+        entries, now = self.__cache[key], time.time()
+        entry = entries.get((address, count))
+        if entry is not None:
+            if entry[0] > now: return entry[1]
+            del entries[(address, count)]
+        for (start, size), (expires, values) in entries.items():
+            if start <= address and address + count <= start + size:
+                if expires > now:
+                    return values[address - start:address - start + count]
+        return None
+
+    def __store(self, values, key, address, count, generation):
+        ''' Caches the values read unless a write happened meanwhile
+
+        :param values: The values read (or the error response)
+        :param key: The table read from
+        :param address: The starting address
+        :param count: The number of values read
+        :param generation: The write generation of the table at the read
+        :returns: The values
+        '''
+        if isinstance(values, ModbusResponse): return values
+        if generation != self.__generation[key]: return values
+        ttl = self.ttl
+        for start, end, range_ttl in self.__ttls[key]:
+            if start <= address and address + count <= end:
+                ttl = range_ttl
+                break
+        if ttl > 0:
+            entries, now = self.__cache[key], time.time()
+            for span, entry in entries.items():
+                if entry[0] <= now: del entries[span]
+            entries[(address, count)] = (now + ttl, values)
+        return values
+
+    def __invalidate(self, key, address, count):
+        ''' Drops the cached values overlapping a written range
+
+        Reads in flight started before the write are not cached
+        and no longer joined by new reads.
+
+        :param key: The table written to
+        :param address: The starting address
+        :param count: The number of values written
+        '''
+        self.__generation[key] += 1
+        entries = self.__cache[key]
+        for start, size in entries.keys():
+            if start < address + count and address < start + size:
+                del entries[(start, size)]
+        for flight in self.__flights.keys():
+            if flight[0] == key and flight[1] < address + count \
+                    and address < flight[1] + flight[2]:
+                del self.__flights[flight]
+
+    def __resolve(self, result, handler):
+        ''' A helper method to apply a handler to the result
+        of a client call, directly or once its Deferred fired.
+
+        :param result: The client result or a Deferred of it
+        :param handler: The callable to convert the result with
+        :returns: The converted result or a Deferred of it
+        '''
+        if hasattr(result, 'addCallback'):
+            return result.addCallback(handler)
+        return handler(result)
+
     def __extract_result(self, fx, result):
         ''' A helper method to extract the values out of
         a response.  TODO make this consistent (values?)
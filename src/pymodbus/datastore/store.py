@@ -46,6 +46,10 @@ or a range read to fail.
 I have both methods implemented, and leave it up to the user to change
 based on their preference.
 """
+from bisect import bisect_left, bisect_right
+from array import array
+from itertools import izip
+from pymodbus.utilities import BitVector, pack_bitstring
 from pymodbus.exceptions import NotImplementedException, ParameterException
 
 #---------------------------------------------------------------------------#
@@ -187,8 +191,272 @@ class ModbusSequentialDataBlock(BaseModbusDataBlock):
         self.values[start:start + len(values)] = values
 
 
+class ModbusRegisterDataBlock(ModbusSequentialDataBlock):
+    ''' Creates a sequential register datastore backed by an array('H')
+
+    This takes two bytes per register instead of a list slot, and
+    getValues returns an array slice which the register responses
+    encode with one byteswap instead of packing each register.
+    '''
+
+    def __init__(self, address, values):
+        ''' Initializes the datastore
+
+        :param address: The starting address of the datastore
+        :param values: Either a list or a single register value
+        '''
+        self.address = address
+        if not hasattr(values, '__iter__'):
+            values = [values]
+        self.values = array('H', values)
+        self.default_value = 0
+
+    @classmethod
+    def create(klass):
+        ''' Factory method to create a datastore with the
+        full address space initialized to 0x00
+
+        :returns: An initialized datastore
+        '''
+        return klass(0x00, array('H', [0x00]) * 65536)
+
+    def default(self, count, value=0):
+        ''' Used to initialize a store to one value
+
+        :param count: The number of fields to set
+        :param value: The default value to set to the fields
+        '''
+        self.default_value = int(value)
+        self.values = array('H', [self.default_value]) * count
+        self.address = 0x00
+
+    def reset(self):
+        ''' Resets the datastore to the initialized default value '''
+        self.values = array('H', [self.default_value]) * len(self.values)
+
+    def setValues(self, address, values):
+        ''' Sets the requested values of the datastore
+
+        :param address: The starting address
+        :param values: The new values to be set
+        '''
+        if not isinstance(values, (list, array)):
+            values = [values]
+        start = address - self.address
+        self.values[start:start + len(values)] = array('H', values)
+
+
+class ModbusBitDataBlock(ModbusSequentialDataBlock):
+    ''' Creates a sequential coil or discrete input datastore
+    packed eight bits per byte in a BitVector
+
+    getValues returns a BitVector which the bit responses encode
+    without expanding it to a list of booleans.
+    '''
+
+    def __init__(self, address, values):
+        ''' Initializes the datastore
+
+        :param address: The starting address of the datastore
+        :param values: Either a list or a single bit value
+        '''
+        self.address = address
+        if not hasattr(values, '__iter__'):
+            values = [values]
+        values = list(values)
+        self.values = BitVector(pack_bitstring(values), len(values))
+        self.default_value = False
+
+    @classmethod
+    def create(klass):
+        ''' Factory method to create a datastore with the
+        full address space initialized to 0x00
+
+        :returns: An initialized datastore
+        '''
+        block = klass(0x00, [])
+        block.values = BitVector(bytearray(8192), 65536)
+        return block
+
+    def default(self, count, value=False):
+        ''' Used to initialize a store to one value
+
+        :param count: The number of fields to set
+        :param value: The default value to set to the fields
+        '''
+        self.default_value = bool(value)
+        fill = '\xff' if self.default_value else '\x00'
+        self.values = BitVector(fill * ((count + 7) // 8), count)
+        self.address = 0x00
+
+    def reset(self):
+        ''' Resets the datastore to the initialized default value '''
+        size = len(self.values)
+        fill = '\xff' if self.default_value else '\x00'
+        self.values = BitVector(fill * ((size + 7) // 8), size)
+
+    def getValues(self, address, count=1):
+        ''' Returns the requested values of the datastore
+
+        :param address: The starting address
+        :param count: The number of values to retrieve
+        :returns: The requested values from a:a+c
+        '''
+        return self.values.extract(address - self.address, count)
+
+    def setValues(self, address, values):
+        ''' Sets the requested values of the datastore
+
+        :param address: The starting address
+        :param values: The new values to be set
+        '''
+        if not isinstance(values, (list, BitVector)):
+            values = [values]
+        self.values.assign(address - self.address, values)
+
+
+class ModbusPagedDataBlock(ModbusSequentialDataBlock):
+    ''' Creates a sequential datastore allocated lazily in pages
+
+    The address space is split into pages of `page_size` values. All
+    the pages start as one shared page of the default value which is
+    never written to, a page gets its own array on the first write
+    landing in it. This
+    lets a server hold many mostly empty slave contexts::
+
+        block = ModbusPagedDataBlock()           # registers
+        block = ModbusPagedDataBlock(bits=True)  # coils / discretes
+    '''
+
+    page_size = 256
+    __default_pages = {}
+
+    def __init__(self, address=0x00, count=65536, bits=False):
+        ''' Initializes the datastore
+
+        :param address: The starting address of the datastore
+        :param count: The number of values in the datastore
+        :param bits: True to store bits instead of registers
+        '''
+        self.address = address
+        self.count = count
+        self.bits = bits
+        self.default_value = False if bits else 0
+        self.__typecode = 'B' if bits else 'H'
+        self.reset()
+
+    @classmethod
+    def create(klass):
+        ''' Factory method to create a datastore with the
+        full address space initialized to 0x00
+
+        :returns: An initialized datastore
+        '''
+        return klass()
+
+    def default(self, count, value=False):
+        ''' Used to initialize a store to one value
+
+        :param count: The number of fields to set
+        :param value: The default value to set to the fields
+        '''
+        self.default_value = bool(value) if self.bits else int(value)
+        self.address = 0x00
+        self.count = count
+        self.reset()
+
+    def __default_page(self):
+        ''' Returns the shared read-only page of the default value '''
+        value = int(self.default_value)
+        key = (self.__typecode, self.page_size, value)
+        page = self.__default_pages.get(key)
+        if page is None:
+            page = array(self.__typecode, [value]) * self.page_size
+            self.__default_pages[key] = page
+        return page
+
+    def reset(self):
+        ''' Resets the datastore to the initialized default value '''
+        pages = (self.count + self.page_size - 1) // self.page_size
+        self.pages = [self.__default_page()] * pages
+
+    @property
+    def allocated(self):
+        ''' The number of pages which have been written to '''
+        shared = self.__default_page()
+        return sum(1 for page in self.pages if page is not shared)
+
+    def validate(self, address, count=1):
+        ''' Checks to see if the request is in range
+
+        :param address: The starting address
+        :param count: The number of values to test for
+        :returns: True if the request in within range, False otherwise
+        '''
+        return self.address <= address and \
+            address + count <= self.address + self.count
+
+    def getValues(self, address, count=1):
+        ''' Returns the requested values of the datastore
+
+        :param address: The starting address
+        :param count: The number of values to retrieve
+        :returns: The requested values from a:a+c
+        '''
+        start, end = address - self.address, address - self.address + count
+        result = array(self.__typecode)
+        while start < end:
+            page, offset = divmod(start, self.page_size)
+            stop = min(self.page_size, offset + end - start)
+            result.extend(self.pages[page][offset:stop])
+            start += stop - offset
+        if self.bits: return map(bool, result)
+        return result
+
+    def setValues(self, address, values):
+        ''' Sets the requested values of the datastore
+
+        :param address: The starting address
+        :param values: The new values to be set
+        '''
+        if not isinstance(values, (list, array)):
+            values = [values]
+        if self.bits:
+            values = [1 if value else 0 for value in values]
+        shared, start, index = self.__default_page(), address - self.address, 0
+        while index < len(values):
+            page, offset = divmod(start + index, self.page_size)
+            stop = min(self.page_size, offset + len(values) - index)
+            if self.pages[page] is shared:
+                self.pages[page] = shared[:]
+            self.pages[page][offset:stop] = array(self.__typecode,
+                values[index:index + stop - offset])
+            index += stop - offset
+
+    def __iter__(self):
+        ''' Iterater over the data block data
+
+        :returns: An iterator of the data block data
+        '''
+        return enumerate(self.getValues(self.address, self.count), self.address)
+
+    def __str__(self):
+        ''' Build a representation of the datastore
+
+        :returns: A string representation of the datastore
+        '''
+        return "PagedDataStore(%d, %d/%d pages)" % (
+            self.count, self.allocated, len(self.pages))
+
+
 class ModbusSparseDataBlock(BaseModbusDataBlock):
-    ''' Creates a sparse modbus datastore '''
+    ''' Creates a sparse modbus datastore
+
+    Next to the values, the block keeps an index of the contiguous
+    populated address ranges as two sorted lists of starts and
+    (exclusive) ends. It is updated by setValues and lets validate
+    bisect for the range holding a request instead of building sets.
+    '''
 
     def __init__(self, values):
         ''' Initializes the datastore
@@ -206,6 +474,7 @@ class ModbusSparseDataBlock(BaseModbusDataBlock):
             "Values for datastore must be a list or dictionary")
         self.default_value = self.values.values()[0].__class__()
         self.address = self.values.iterkeys().next()
+        self.__build_index()
 
     @classmethod
     def create(klass):
@@ -216,6 +485,21 @@ class ModbusSparseDataBlock(BaseModbusDataBlock):
         '''
         return klass([0x00] * 65536)
 
+    def default(self, count, value=False):
+        ''' Used to initialize a store to one value
+
+        :param count: The number of fields to set
+        :param value: The default value to set to the fields
+        '''
+        self.default_value = value
+        self.values = dict.fromkeys(xrange(count), value)
+        self.address = 0x00
+        self.__build_index()
+
+    def reset(self):
+        ''' Resets the datastore to the initialized default value '''
+        self.values = dict.fromkeys(self.values, self.default_value)
+
     def validate(self, address, count=1):
         ''' Checks to see if the request is in range
 
@@ -224,8 +508,8 @@ class ModbusSparseDataBlock(BaseModbusDataBlock):
         :returns: True if the request in within range, False otherwise
         '''
         if count == 0: return False
-        handle = set(range(address, address + count))
-        return handle.issubset(set(self.values.iterkeys()))
+        index = bisect_right(self.__starts, address) - 1
+        return index >= 0 and self.__ends[index] >= address + count
 
     def getValues(self, address, count=1):
         ''' Returns the requested values of the datastore
@@ -234,7 +518,7 @@ class ModbusSparseDataBlock(BaseModbusDataBlock):
         :param count: The number of values to retrieve
         :returns: The requested values from a:a+c
         '''
-        return [self.values[i] for i in range(address, address + count)]
+        return map(self.values.__getitem__, xrange(address, address + count))
 
     def setValues(self, address, values):
         ''' Sets the requested values of the datastore
@@ -243,10 +527,52 @@ class ModbusSparseDataBlock(BaseModbusDataBlock):
         :param values: The new values to be set
         '''
         if isinstance(values, dict):
-            for idx, val in values.iteritems():
-                self.values[idx] = val
+            self.values.update(values)
+            for start, end in self.__runs(sorted(values.iterkeys())):
+                self.__index_range(start, end)
         else:
             if not isinstance(values, list):
                 values = [values]
-            for idx, val in enumerate(values):
-                self.values[address + idx] = val
+            self.values.update(izip(xrange(address, address + len(values)), values))
+            if values and not self.validate(address, len(values)):
+                self.__index_range(address, address + len(values))
+
+    #-----------------------------------------------------------------------#
+    # Range index
+    #-----------------------------------------------------------------------#
+    @staticmethod
+    def __runs(keys):
+        ''' Yields the contiguous (start, end) runs of sorted addresses
+
+        :param keys: The sorted addresses
+        '''
+        start = end = None
+        for key in keys:
+            if key != end:
+                if start is not None: yield start, end
+                start = key
+            end = key + 1
+        if start is not None: yield start, end
+
+    def __build_index(self):
+        ''' Builds the range index from the populated addresses '''
+        self.__starts, self.__ends = [], []
+        for start, end in self.__runs(sorted(self.values.iterkeys())):
+            self.__starts.append(start)
+            self.__ends.append(end)
+
+    def __index_range(self, start, end):
+        ''' Adds a populated range, merging it with the ranges
+        it overlaps or touches.
+
+        :param start: The first address of the range
+        :param end: The address after the range
+        '''
+        starts, ends = self.__starts, self.__ends
+        lo = bisect_left(ends, start)
+        hi = bisect_right(starts, end)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
@@ -62,11 +62,22 @@ class ConnectionException(ModbusException):
         message = "[Connection] %s" % string
         ModbusException.__init__(self, message)
 
+
+class TimeOutException(ModbusException):
+    ''' Error resulting from a request which was not answered in time '''
+
+    def __init__(self, string=""):
+        ''' Initialize the exception
+        :param string: The message to append to the error
+        '''
+        message = "[Timeout] %s" % string
+        ModbusException.__init__(self, message)
+
 #---------------------------------------------------------------------------#
 # Exported symbols
 #---------------------------------------------------------------------------#
 __all__ = [
     "ModbusException", "ModbusIOException",
     "ParameterException", "NotImplementedException",
-    "ConnectionException",
+    "ConnectionException", "TimeOutException",
 ]
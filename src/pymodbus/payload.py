@@ -5,7 +5,9 @@ Modbus Payload Builders
 A collection of utilities for building and decoding
 modbus messages payloads.
 '''
-from struct import pack, unpack
+import re
+from struct import pack, unpack, calcsize, Struct
+from operator import itemgetter
 from pymodbus.interfaces import IPayloadBuilder
 from pymodbus.constants import Endian
 from pymodbus.utilities import pack_bitstring
@@ -320,7 +322,62 @@ class BinaryPayloadDecoder(object):
         self._pointer += size
         return self._payload[self._pointer - size:self._pointer]
 
+
+class RegisterDecoder(object):
+    '''
+    A precompiled decoder for a fixed layout of values spread over
+    a list of registers. The register reordering and the struct
+    formats are computed once, so each decode is a single pack and
+    unpack of the register list. What follows is a simple example::
+
+        decoder = RegisterDecoder('fff', wordorder=Endian.Little)
+        x, y, z = decoder.decode(response.registers)
+
+    The byteorder is the order of the two bytes within a register,
+    the wordorder is the order of the registers within a value.
+    '''
+
+    __field = re.compile(r'(\d*)([a-zA-Z?])')
+
+    def __init__(self, fmt, byteorder=Endian.Big, wordorder=Endian.Big):
+        ''' Initialize a new register decoder
+
+        :param fmt: The struct format of the values without endian prefix
+        :param byteorder: The endianess of the bytes in a register
+        :param wordorder: The endianess of the registers in a value
+        '''
+        self._values = Struct('>' + fmt)
+        if self._values.size % 2:
+            raise ParameterException('Format %s is not register aligned' % fmt)
+        self.count = self._values.size // 2
+        self._registers = Struct(byteorder + 'H' * self.count)
+        self._reorder = None
+        if wordorder != Endian.Big:
+            order = []
+            for count, code in self.__field.findall(fmt):
+                if code in 'spx': # byte blocks keep their order
+                    fields, size = 1, int(count or 1)
+                else: fields, size = int(count or 1), calcsize('>' + code)
+                if size % 2:
+                    raise ParameterException('Field %s is not register aligned' % code)
+                for _ in range(fields):
+                    words = range(len(order), len(order) + size // 2)
+                    if code not in 'spx': words.reverse()
+                    order.extend(words)
+            if order != range(self.count):
+                self._reorder = itemgetter(*order)
+
+    def decode(self, registers):
+        ''' Decode the values from a list of registers
+
+        :param registers: The register results to decode
+        :returns: A tuple of the decoded values
+        '''
+        if self._reorder is not None:
+            registers = self._reorder(registers)
+        return self._values.unpack(self._registers.pack(*registers))
+
 #---------------------------------------------------------------------------#
 # Exported Identifiers
 #---------------------------------------------------------------------------#
-__all__ = ["BinaryPayloadBuilder", "BinaryPayloadDecoder"]
+__all__ = ["BinaryPayloadBuilder", "BinaryPayloadDecoder", "RegisterDecoder"]
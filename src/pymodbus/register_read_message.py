@@ -3,6 +3,7 @@ Register Reading Request/Response
 ---------------------------------
 '''
 import struct
+from pymodbus.utilities import pack_registers, unpack_registers
 from pymodbus.pdu import ModbusRequest
 from pymodbus.pdu import ModbusResponse
 from pymodbus.pdu import ModbusExceptions as merror
@@ -66,10 +67,7 @@ class ReadRegistersResponseBase(ModbusResponse):
 
         :returns: The encoded packet
         '''
-        result = chr(len(self.registers) * 2)
-        for register in self.registers:
-            result += struct.pack('>H', register)
-        return result
+        return chr(len(self.registers) * 2) + pack_registers(self.registers)
 
     def decode(self, data):
         ''' Decode a register response packet
@@ -77,9 +75,7 @@ class ReadRegistersResponseBase(ModbusResponse):
         :param data: The request to decode
         '''
         byte_count = ord(data[0])
-        self.registers = []
-        for i in range(1, byte_count + 1, 2):
-            self.registers.append(struct.unpack('>H', data[i:i + 2])[0])
+        self.registers = unpack_registers(data, 1, byte_count // 2)
 
     def getRegister(self, index):
         ''' Get the requested register
@@ -240,9 +236,7 @@ class ReadWriteMultipleRegistersRequest(ModbusRequest):
         result = struct.pack('>HHHHB',
                 self.read_address,  self.read_count, \
                 self.write_address, self.write_count, self.write_byte_count)
-        for register in self.write_registers:
-            result += struct.pack('>H', register)
-        return result
+        return result + pack_registers(self.write_registers)
 
     def decode(self, data):
         ''' Decode the register request packet
@@ -252,10 +246,8 @@ class ReadWriteMultipleRegistersRequest(ModbusRequest):
         self.read_address,  self.read_count,  \
         self.write_address, self.write_count, \
         self.write_byte_count = struct.unpack('>HHHHB', data[:9])
-        self.write_registers  = []
-        for i in range(9, self.write_byte_count + 9, 2):
-            register = struct.unpack('>H', data[i:i + 2])[0]
-            self.write_registers.append(register)
+        self.write_registers  = unpack_registers(data, 9,
+                self.write_byte_count // 2)
 
     def execute(self, context):
         ''' Run a write single register request against a datastore
@@ -313,10 +305,7 @@ class ReadWriteMultipleRegistersResponse(ModbusResponse):
 
         :returns: The encoded packet
         '''
-        result = chr(len(self.registers) * 2)
-        for register in self.registers:
-            result += struct.pack('>H', register)
-        return result
+        return chr(len(self.registers) * 2) + pack_registers(self.registers)
 
     def decode(self, data):
         ''' Decode the register response packet
@@ -324,8 +313,7 @@ class ReadWriteMultipleRegistersResponse(ModbusResponse):
         :param data: The response to decode
         '''
         bytecount = ord(data[0])
-        for i in range(1, bytecount, 2):
-            self.registers.append(struct.unpack('>H', data[i:i + 2])[0])
+        self.registers = unpack_registers(data, 1, bytecount // 2)
 
     def __str__(self):
         ''' Returns a string representation of the instance
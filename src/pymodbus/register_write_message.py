@@ -3,6 +3,7 @@ Register Writing Request/Response Messages
 -------------------------------------------
 '''
 import struct
+from pymodbus.utilities import pack_registers, unpack_registers
 from pymodbus.pdu import ModbusRequest
 from pymodbus.pdu import ModbusResponse
 from pymodbus.pdu import ModbusExceptions as merror
@@ -146,11 +147,7 @@ class WriteMultipleRegistersRequest(ModbusRequest):
         packet = struct.pack('>HHB', self.address, self.count, self.byte_count)
         if self.skip_encode:
             return packet + ''.join(self.values)
-        
-        for value in self.values:
-            packet += struct.pack('>H', value)
-
-        return packet
+        return packet + pack_registers(self.values)
 
     def decode(self, data):
         ''' Decode a write single register packet packet request
@@ -159,9 +156,7 @@ class WriteMultipleRegistersRequest(ModbusRequest):
         '''
         self.address, self.count, \
         self.byte_count = struct.unpack('>HHB', data[:5])
-        self.values = []  # reset
-        for idx in range(5, (self.count * 2) + 5, 2):
-            self.values.append(struct.unpack('>H', data[idx:idx + 2])[0])
+        self.values = unpack_registers(data, 5, self.count)
 
     def execute(self, context):
         ''' Run a write single register request against a datastore
@@ -4,12 +4,14 @@ Implementation of a Twisted Modbus Server
 
 '''
 from binascii import b2a_hex
-from twisted.internet import protocol
+from collections import deque
+from twisted.internet import protocol, defer, threads
 from twisted.internet.protocol import ServerFactory
+from twisted.python.threadpool import ThreadPool
 
 from pymodbus.constants import Defaults
 from pymodbus.factory import ServerDecoder
-from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore import ModbusServerContext, ModbusSlaveContext
 from pymodbus.device import ModbusControlBlock
 from pymodbus.device import ModbusAccessControl
 from pymodbus.device import ModbusDeviceIdentification
@@ -24,6 +26,91 @@ import logging
 _logger = logging.getLogger(__name__)
 
 
+#---------------------------------------------------------------------------#
+# Deferred Contexts
+#---------------------------------------------------------------------------#
+class _PendingResult(Exception):
+    ''' Raised to abandon a request run until a Deferred fired '''
+
+    def __init__(self, deferred):
+        Exception.__init__(self)
+        self.deferred = deferred
+
+
+class ModbusDeferredContext(object):
+    '''
+    Runs a request against a slave context whose methods may return
+    Deferreds (a RemoteSlaveContext over a twisted client, ...).
+
+    Requests execute synchronously, so when a context call returns a
+    Deferred the run is abandoned, and once the Deferred fired the
+    request is executed again from the start, replaying the results
+    of the calls made so far in order. Every context call thus
+    reaches the context once, and a synchronous context is run in a
+    single pass.
+    '''
+
+    def __init__(self, context):
+        ''' Initializes a new instance of the adapter
+
+        :param context: The slave context to run requests against
+        '''
+        self.context = context
+        self.results = []
+        self.calls = 0
+
+    def execute(self, request):
+        ''' Executes a request against the context
+
+        :param request: The decoded request message
+        :returns: The response or a Deferred of the response
+        '''
+        self.calls = 0
+        try: return request.execute(self)
+        except _PendingResult, pending:
+            return pending.deferred.addCallback(self.__resume, request)
+
+    def __resume(self, result, request):
+        ''' Records the result of a pending call and runs the request again
+
+        :param result: The result of the pending call
+        :param request: The decoded request message
+        '''
+        self.results.append(result)
+        return self.execute(request)
+
+    def __call(self, method, *args):
+        ''' Calls the context or replays the result of a previous run
+
+        :param method: The context method to call
+        :returns: The result of the call
+        '''
+        index, self.calls = self.calls, self.calls + 1
+        if index < len(self.results):
+            return self.results[index]
+        result = method(*args)
+        if isinstance(result, defer.Deferred):
+            raise _PendingResult(result)
+        self.results.append(result)
+        return result
+
+    def validate(self, fx, address, count=1):
+        ''' Validates the request to make sure it is in range '''
+        return self.__call(self.context.validate, fx, address, count)
+
+    def getValues(self, fx, address, count=1):
+        ''' Returns the requested values of the context '''
+        return self.__call(self.context.getValues, fx, address, count)
+
+    def setValues(self, fx, address, values):
+        ''' Sets the context with the supplied values '''
+        return self.__call(self.context.setValues, fx, address, values)
+
+    def __getattr__(self, name):
+        ''' Forwards anything else to the wrapped context '''
+        return getattr(self.context, name)
+
+
 #---------------------------------------------------------------------------#
 # Modbus TCP Server
 #---------------------------------------------------------------------------#
@@ -39,6 +126,11 @@ class ModbusTcpProtocol(protocol.Protocol):
         '''
         _logger.debug("Client Connected [%s]" % self.transport.getHost())
         self.framer = self.factory.framer(decoder=self.factory.decoder)
+        self.batch = None
+        self.pending = deque()
+        if self.factory.nodelay is not None and \
+                hasattr(self.transport, 'setTcpNoDelay'):
+            self.transport.setTcpNoDelay(self.factory.nodelay)
 
     def connectionLost(self, reason):
         ''' Callback for when a client disconnects
@@ -46,6 +138,7 @@ class ModbusTcpProtocol(protocol.Protocol):
         :param reason: The client's reason for disconnecting
         '''
         _logger.debug("Client Disconnected: %s" % reason)
+        self.pending.clear()
 
     def dataReceived(self, data):
         ''' Callback when we receive any data
@@ -55,19 +148,69 @@ class ModbusTcpProtocol(protocol.Protocol):
         if _logger.isEnabledFor(logging.DEBUG):
             _logger.debug(" ".join([hex(ord(x)) for x in data]))
         if not self.factory.control.ListenOnly:
-            self.framer.processIncomingPacket(data, self._execute)
+            self.batch = []
+            try: self.framer.processIncomingPacket(data, self._execute)
+            finally: batch, self.batch = self.batch, None
+            if len(batch) == 1: self.transport.write(batch[0])
+            elif batch: self.transport.writeSequence(batch)
 
     def _execute(self, request):
-        ''' Executes the request and returns the result
+        ''' Executes the request and sends the result
+
+        A context may answer with Deferreds, in which case the
+        response is sent once they fired (local slave contexts never
+        do and are run directly). Responses are always sent
+        in the order the requests were received, so a response that
+        is ready waits behind the pending ones of its connection.
 
         :param request: The decoded request message
         '''
         try:
             context = self.factory.store[request.unit_id]
-            response = request.execute(context)
+            if request.function_code in self.factory.offload:
+                response = self.factory.offloadRequest(request, context)
+            elif isinstance(context, ModbusSlaveContext):
+                response = request.execute(context)
+            else: response = ModbusDeferredContext(context).execute(request)
         except Exception, ex:
             _logger.debug("Datastore unable to fulfill request: %s" % ex)
             response = request.doException(merror.SlaveFailure)
+        if isinstance(response, defer.Deferred):
+            slot = [request, None]
+            self.pending.append(slot)
+            response.addErrback(self._failed, request)
+            response.addCallback(self._complete, slot)
+        elif self.pending:
+            self.pending.append([request, response])
+        else: self._respond(request, response)
+
+    def _failed(self, failure, request):
+        ''' Converts the failure of a deferred request to a response
+
+        :param failure: The failure of the request
+        :param request: The decoded request message
+        :returns: The exception response
+        '''
+        _logger.debug("Datastore unable to fulfill request: %s" % failure)
+        return request.doException(merror.SlaveFailure)
+
+    def _complete(self, response, slot):
+        ''' Sends the responses that are no longer waiting on a
+        previous request of the connection
+
+        :param response: The response of the completed request
+        :param slot: The pending entry of the completed request
+        '''
+        slot[1] = response
+        while self.pending and self.pending[0][1] is not None:
+            self._respond(*self.pending.popleft())
+
+    def _respond(self, request, response):
+        ''' Sends the response to a request
+
+        :param request: The decoded request message
+        :param response: The response to send
+        '''
         #self.framer.populateResult(response)
         response.transaction_id = request.transaction_id
         response.unit_id = request.unit_id
@@ -83,6 +226,8 @@ class ModbusTcpProtocol(protocol.Protocol):
             pdu = self.framer.buildPacket(message)
             if _logger.isEnabledFor(logging.DEBUG):
                 _logger.debug('send: %s' % b2a_hex(pdu))
+            if self.batch is not None:
+                return self.batch.append(pdu)
             return self.transport.write(pdu)
 
 
@@ -91,10 +236,29 @@ class ModbusServerFactory(ServerFactory):
     Builder class for a modbus server
 
     This also holds the server datastore so that it is
-    persisted between connections
+    persisted between connections. The responses to all the
+    requests decoded from one read are written to the transport
+    at once. Set nodelay to True to disable Nagle on the client
+    connections (lower latency for clients waiting on each
+    response), to False to force it on, or leave it None to keep
+    the system default.
+
+    Requests with a function code listed in offload are executed in
+    a pool of at most `workers` threads instead of the reactor
+    thread, so slow requests (file records, a disk backed store)
+    do not hold up the cheap ones. Their responses still keep the
+    request order of their connection. Once `queue_limit` offloaded
+    requests are waiting or running, new ones are answered with a
+    SlaveBusy exception. The offloaded requests run concurrently
+    with the reactor thread, so their slaves must be thread safe
+    (ModbusVersionedSlaveContext) and must not return Deferreds.
     '''
 
-    protocol = ModbusTcpProtocol
+    protocol    = ModbusTcpProtocol
+    nodelay     = None
+    offload     = frozenset()
+    workers     = 4
+    queue_limit = 64
 
     def __init__(self, store, framer=None, identity=None):
         ''' Overloaded initializer for the modbus factory
@@ -116,6 +280,56 @@ class ModbusServerFactory(ServerFactory):
         if isinstance(identity, ModbusDeviceIdentification):
             self.control.Identity.update(identity)
 
+        self.threadpool = None
+        self.queued = 0
+        self.peak = 0
+        self.offloaded = 0
+        self.rejected = 0
+
+    def offloadRequest(self, request, context):
+        ''' Executes a request in the thread pool
+
+        :param request: The decoded request message
+        :param context: The slave context to execute it against
+        :returns: A Deferred of the response (or a busy response)
+        '''
+        from twisted.internet import reactor
+
+        if self.queued >= self.queue_limit:
+            self.rejected += 1
+            return request.doException(merror.SlaveBusy)
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(0, self.workers, "ModbusServerFactory")
+            self.threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown',
+                self.threadpool.stop)
+        self.queued += 1
+        self.offloaded += 1
+        self.peak = max(self.peak, self.queued)
+        deferred = threads.deferToThreadPool(reactor, self.threadpool,
+            request.execute, context)
+        return deferred.addBoth(self.__offloaded)
+
+    def __offloaded(self, result):
+        ''' Callback for when an offloaded request finished
+
+        :param result: The response or failure, passed through
+        '''
+        self.queued -= 1
+        return result
+
+    def getOffloadStatistics(self):
+        ''' Returns the counters of the offloaded requests
+
+        :returns: A dict of the queue depth and totals
+        '''
+        return {
+            'queued':    self.queued,
+            'peak':      self.peak,
+            'offloaded': self.offloaded,
+            'rejected':  self.rejected,
+        }
+
 
 #---------------------------------------------------------------------------#
 # Modbus UDP Server
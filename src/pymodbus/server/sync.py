@@ -4,9 +4,16 @@ Implementation of a Threaded Modbus Server
 
 '''
 from binascii import b2a_hex
+from collections import deque
 import SocketServer
 import serial
 import socket
+import select
+import errno
+import os
+import time
+import signal
+import multiprocessing
 
 from pymodbus.constants import Defaults
 from pymodbus.factory import ServerDecoder
@@ -189,6 +196,87 @@ class ModbusDisconnectedRequestHandler(ModbusBaseRequestHandler):
             return self.request.sendto(pdu, self.client_address)
 
 
+class ModbusMultiplexedRequestHandler(ModbusBaseRequestHandler):
+    ''' Implements the modbus server protocol
+
+    This is the client handler of the ModbusSelectTcpServer. Instead
+    of owning a thread and looping in handle, the server calls handle
+    once every time the client socket is readable and the responses
+    that the socket cannot take right away are kept in a buffer until
+    it is writable again. The pending attribute counts the buffered
+    bytes so the server can stop reading from a client which does not
+    read its responses.
+    '''
+
+    def __init__(self, request, client_address, server):
+        ''' Initializes the handler without running it
+
+        :param request: The non blocking client socket
+        :param client_address: The address of the client
+        :param server: The server owning the client
+        '''
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.buffer = deque()
+        self.offset = 0
+        self.pending = 0
+        self.setup()
+
+    def handle(self):
+        ''' Callback when the client socket is readable
+        '''
+        try:
+            data = self.request.recv(4096)
+        except socket.error, msg:
+            if msg.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return
+            _logger.error("Socket error occurred %s" % msg)
+            data = ''
+        if not data:
+            self.running = False
+            return
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(" ".join([hex(ord(x)) for x in data]))
+        self.framer.processIncomingPacket(data, self.execute)
+
+    def send(self, message):
+        ''' Send a request (string) to the network
+
+        :param message: The unencoded modbus response
+        '''
+        if message.should_respond:
+            #self.server.control.Counter.BusMessage += 1
+            pdu = self.framer.buildPacket(message)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug('send: %s' % b2a_hex(pdu))
+            self.buffer.append(pdu)
+            self.pending += len(pdu)
+            if len(self.buffer) == 1:
+                self.flush()
+
+    def flush(self):
+        ''' Writes as much of the buffered output as the socket takes
+
+        :returns: True if output is still pending, False otherwise
+        '''
+        try:
+            while self.buffer:
+                head = self.buffer[0]
+                sent = self.request.send(buffer(head, self.offset))
+                self.offset += sent
+                self.pending -= sent
+                if self.offset < len(head): break
+                self.buffer.popleft()
+                self.offset = 0
+        except socket.error, msg:
+            if msg.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _logger.error("Socket error occurred %s" % msg)
+                self.running = False
+                self.buffer.clear()
+                self.offset = self.pending = 0
+        return self.pending > 0
+
+
 #---------------------------------------------------------------------------#
 # Server Implementations
 #---------------------------------------------------------------------------#
@@ -198,7 +286,9 @@ class ModbusTcpServer(SocketServer.ThreadingTCPServer):
 
     We inherit and overload the socket server so that we
     can control the client threads as well as have a single
-    server context instance.
+    server context instance. As every client runs in its own
+    thread, use ModbusVersionedSlaveContext slaves for reads
+    which must not see a concurrent write half done.
     '''
 
     def __init__(self, context, framer=None, identity=None, address=None):
@@ -243,6 +333,267 @@ class ModbusTcpServer(SocketServer.ThreadingTCPServer):
             thread.running = False
 
 
+class ModbusSelectTcpServer(object):
+    '''
+    A modbus single threaded tcp socket server
+
+    All the client connections are multiplexed in the thread running
+    serve_forever with epoll (or select where epoll is missing), so a
+    server with hundreds of clients still runs a single thread. The
+    requests are decoded by the same framers and run by the same
+    execute path as the threaded server. As requests run one at a
+    time, plain ModbusSlaveContext slaves are safe to use.
+
+    A client whose unsent responses grow past buffer_limit bytes is
+    not read from until they drain back under half of it, so a client
+    pipelining requests without reading cannot grow the server memory.
+    '''
+
+    buffer_limit = 65536
+
+    def __init__(self, context, framer=None, identity=None, address=None,
+                 reuse_port=False):
+        ''' Initializes and binds the server socket
+
+        If the identify structure is not passed in, the ModbusControlBlock
+        uses its own empty structure.
+
+        :param context: The ModbusServerContext datastore
+        :param framer: The framer strategy to use
+        :param identity: An optional identify structure
+        :param address: An optional (interface, port) to bind to.
+        :param reuse_port: True to share the port with other processes
+        '''
+        self.threads = []
+        self.decoder = ServerDecoder()
+        self.framer  = framer  or ModbusSocketFramer
+        self.context = context or ModbusServerContext()
+        self.control = ModbusControlBlock()
+        self.address = address or ("", Defaults.Port)
+        self.running = False
+
+        if isinstance(identity, ModbusDeviceIdentification):
+            self.control.Identity.update(identity)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(self.address)
+        self.socket.listen(128)
+        self.socket.setblocking(0)
+        self.server_address = self.socket.getsockname()
+        self.__clients = {}
+        self.__writers = set()
+        self.__paused = set()
+        self.__epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self.__register(self.socket.fileno())
+
+    def __register(self, fd, write=False, read=True):
+        ''' Updates the events watched for a socket
+
+        :param fd: The file descriptor of the socket
+        :param write: True to also watch for the socket being writable
+        :param read: False to stop watching for the socket being readable
+        '''
+        if write: self.__writers.add(fd)
+        else: self.__writers.discard(fd)
+        if read: self.__paused.discard(fd)
+        else: self.__paused.add(fd)
+        if self.__epoll:
+            mask = ((select.EPOLLIN if read else 0)
+                | (select.EPOLLOUT if write else 0))
+            try: self.__epoll.modify(fd, mask)
+            except IOError: self.__epoll.register(fd, mask)
+
+    def __poll(self, timeout):
+        ''' Waits for socket events
+
+        :param timeout: The seconds to wait for an event
+        :returns: A list of (fd, readable, writable)
+        '''
+        if self.__epoll:
+            return [(fd, event & ~select.EPOLLOUT, event & select.EPOLLOUT)
+                for fd, event in self.__epoll.poll(timeout)]
+        readers = [self.socket.fileno()] + [fd for fd in self.__clients
+            if fd not in self.__paused]
+        readers, writers, _ = select.select(readers, list(self.__writers),
+            [], timeout)
+        return [(fd, fd in readers, fd in writers)
+            for fd in set(readers) | set(writers)]
+
+    def __accept(self):
+        ''' Accepts all the pending client connections
+        '''
+        while True:
+            try: request, client = self.socket.accept()
+            except socket.error, msg:
+                if msg.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    _logger.error("Socket error occurred %s" % msg)
+                return
+            request.setblocking(0)
+            handler = ModbusMultiplexedRequestHandler(request, client, self)
+            self.__clients[request.fileno()] = handler
+            self.__register(request.fileno())
+
+    def __close(self, fd):
+        ''' Closes a client connection
+
+        :param fd: The file descriptor of the client socket
+        '''
+        handler = self.__clients.pop(fd)
+        self.__writers.discard(fd)
+        self.__paused.discard(fd)
+        if self.__epoll: self.__epoll.unregister(fd)
+        handler.finish()
+        handler.request.close()
+
+    def serve_forever(self, poll_interval=0.5):
+        ''' Serves the clients until shutdown is called
+
+        :param poll_interval: The seconds between checks for a shutdown
+        '''
+        _logger.debug("Started serving clients")
+        listener, self.running = self.socket.fileno(), True
+        while self.running:
+            try: events = self.__poll(poll_interval)
+            except (IOError, select.error), msg:
+                if msg.args[0] == errno.EINTR: continue
+                raise
+            for fd, readable, writable in events:
+                if fd == listener:
+                    self.__accept()
+                    continue
+                handler = self.__clients.get(fd)
+                if handler is None: continue
+                try:
+                    if readable: handler.handle()
+                    if writable: handler.flush()
+                except Exception, ex:
+                    _logger.error("Client failure %s" % ex)
+                    handler.running = False
+                limit = self.buffer_limit
+                if fd in self.__paused: limit //= 2
+                paused = handler.pending > limit
+                pending = handler.pending > 0
+                if not handler.running:
+                    self.__close(fd)
+                elif (pending != (fd in self.__writers)
+                      or paused != (fd in self.__paused)):
+                    self.__register(fd, pending, not paused)
+
+    def shutdown(self):
+        ''' Stops serve_forever at its next poll
+        '''
+        self.running = False
+
+    def server_close(self):
+        ''' Callback for stopping the running server
+        '''
+        _logger.debug("Modbus server stopped")
+        self.running = False
+        for fd in self.__clients.keys():
+            self.__close(fd)
+        if self.__epoll: self.__epoll.close()
+        self.socket.close()
+
+
+class ModbusMultiProcessTcpServer(object):
+    '''
+    A modbus tcp server running in several processes
+
+    The supervisor forks `workers` processes that each run a
+    ModbusSelectTcpServer bound to the same port with SO_REUSEPORT,
+    so the kernel spreads the connections over the processes and
+    the throughput scales with the cores. A worker that dies is
+    restarted, one that dies right after starting is restarted
+    after a second so a bad setup does not turn into a fork loop.
+
+    The workers inherit the context through fork, so only blocks
+    living in shared memory (ModbusMappedDataBlock) are seen by all
+    of them, writes to any other block stay in the worker that
+    handled the request. Writes to a mapped bit block are a read
+    modify write of whole bytes, so give each worker its own coils
+    or only write them through one connection.
+    '''
+
+    def __init__(self, context, framer=None, identity=None, address=None,
+                 workers=None):
+        ''' Initializes the supervisor
+
+        :param context: The ModbusServerContext datastore
+        :param framer: The framer strategy to use
+        :param identity: An optional identify structure
+        :param address: An optional (interface, port) to bind to.
+        :param workers: The number of processes (defaults to the cpu count)
+        '''
+        self.context  = context or ModbusServerContext()
+        self.framer   = framer  or ModbusSocketFramer
+        self.identity = identity
+        self.address  = address or ("", Defaults.Port)
+        self.workers  = workers or multiprocessing.cpu_count()
+        self.children = {}
+        self.restarts = 0
+        self.running  = False
+
+    def __spawn(self):
+        ''' Forks a new worker process
+        '''
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                server = ModbusSelectTcpServer(self.context, self.framer,
+                    self.identity, self.address, reuse_port=True)
+                server.serve_forever()
+            except Exception, ex:
+                _logger.error("Worker failure %s" % ex)
+                code = 1
+            finally: os._exit(code)
+        _logger.debug("Started worker %d" % pid)
+        self.children[pid] = time.time()
+        if not self.running:  # shutdown ran before the worker was known
+            os.kill(pid, signal.SIGTERM)
+
+    def serve_forever(self):
+        ''' Starts the workers and restarts them until shutdown
+        '''
+        self.running = True
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        for _ in range(self.workers):
+            self.__spawn()
+        while self.children:
+            try: pid, status = os.wait()
+            except OSError, ex:
+                if ex.errno == errno.EINTR: continue
+                if ex.errno == errno.ECHILD: break
+                raise
+            started = self.children.pop(pid, None)
+            if started is None or not self.running: continue
+            _logger.error("Worker %d exited with %d" % (pid, status))
+            if time.time() - started < 1: time.sleep(1)
+            if not self.running: continue
+            self.restarts += 1
+            self.__spawn()
+
+    def shutdown(self, *args):
+        ''' Stops the workers, serve_forever returns once they exited
+        '''
+        self.running = False
+        for pid in self.children:
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError: pass
+
+    def server_close(self):
+        ''' Callback for stopping the running server
+        '''
+        _logger.debug("Modbus server stopped")
+        self.shutdown()
+
+
 class ModbusUdpServer(SocketServer.ThreadingUDPServer):
     '''
     A modbus threaded udp socket server
@@ -401,6 +752,33 @@ def StartTcpServer(context=None, identity=None, address=None):
     server.serve_forever()
 
 
+def StartSelectTcpServer(context=None, identity=None, address=None):
+    ''' A factory to start and run a single threaded tcp modbus server
+
+    :param context: The ModbusServerContext datastore
+    :param identity: An optional identify structure
+    :param address: An optional (interface, port) to bind to.
+    '''
+    framer = ModbusSocketFramer
+    server = ModbusSelectTcpServer(context, framer, identity, address)
+    server.serve_forever()
+
+
+def StartMultiProcessTcpServer(context=None, identity=None, address=None,
+        workers=None):
+    ''' A factory to start and run a multi process tcp modbus server
+
+    :param context: The ModbusServerContext datastore
+    :param identity: An optional identify structure
+    :param address: An optional (interface, port) to bind to.
+    :param workers: The number of processes (defaults to the cpu count)
+    '''
+    framer = ModbusSocketFramer
+    server = ModbusMultiProcessTcpServer(context, framer, identity,
+        address, workers)
+    server.serve_forever()
+
+
 def StartUdpServer(context=None, identity=None, address=None):
     ''' A factory to start and run a udp modbus server
 
@@ -433,5 +811,6 @@ def StartSerialServer(context=None, identity=None, **kwargs):
 # Exported symbols
 #---------------------------------------------------------------------------#
 __all__ = [
-    "StartTcpServer", "StartUdpServer", "StartSerialServer"
+    "StartTcpServer", "StartSelectTcpServer", "StartMultiProcessTcpServer",
+    "StartUdpServer", "StartSerialServer"
 ]
@@ -4,6 +4,7 @@ Collection of transaction based abstractions
 import sys
 import struct
 import socket
+from collections import deque
 from binascii import b2a_hex, a2b_hex
 
 from pymodbus.exceptions import ModbusIOException
@@ -117,22 +118,40 @@ class ModbusTransactionManager(object):
 class DictTransactionManager(ModbusTransactionManager):
     ''' Impelements a transaction for a manager where the
     results are keyed based on the supplied transaction id.
+
+    The transactions are kept in a fixed table of slots indexed by
+    the low bits of their identifier, twice as large as the window
+    of requests in flight. getNextTID skips the identifiers whose
+    slot is still taken, so an identifier wrapping around never
+    replaces a live transaction.
     '''
 
-    def __init__(self, client):
+    def __init__(self, client, window=Defaults.Window):
         ''' Initializes an instance of the ModbusTransactionManager
 
         :param client: The client socket wrapper
-        '''
-        self.transactions = {}
+        :param window: The number of transactions kept in flight
+        '''
+        size = 1
+        while size < 2 * window: size <<= 1
+        self.window = window
+        self.collisions = 0
+        self.__mask = size - 1
+        self.__count = 0
+        self.__tids = [None] * size
+        self.transactions = [None] * size
         super(DictTransactionManager, self).__init__(client)
 
+    def __len__(self):
+        ''' Returns the number of transactions in flight '''
+        return self.__count
+
     def __iter__(self):
         ''' Iterater over the current managed transactions
 
         :returns: An iterator of the managed transactions
         '''
-        return iter(self.transactions.keys())
+        return iter([tid for tid in self.__tids if tid is not None])
 
     def addTransaction(self, request, tid=None):
         ''' Adds a transaction to the handler
@@ -145,7 +164,15 @@ class DictTransactionManager(ModbusTransactionManager):
         '''
         tid = tid if tid != None else request.transaction_id
         _logger.debug("adding transaction %d" % tid)
-        self.transactions[tid] = request
+        slot = tid & self.__mask
+        if self.__tids[slot] is None:
+            self.__count += 1
+        else:
+            self.collisions += 1
+            _logger.warning("transaction %d replaces transaction %d"
+                % (tid, self.__tids[slot]))
+        self.__tids[slot] = tid
+        self.transactions[slot] = request
 
     def getTransaction(self, tid):
         ''' Returns a transaction matching the referenced tid
@@ -155,7 +182,12 @@ class DictTransactionManager(ModbusTransactionManager):
         :param tid: The transaction to retrieve
         '''
         _logger.debug("getting transaction %d" % tid)
-        return self.transactions.pop(tid, None)
+        slot = tid & self.__mask
+        if self.__tids[slot] != tid: return None
+        request, self.transactions[slot] = self.transactions[slot], None
+        self.__tids[slot] = None
+        self.__count -= 1
+        return request
 
     def delTransaction(self, tid):
         ''' Removes a transaction matching the referenced tid
@@ -163,7 +195,31 @@ class DictTransactionManager(ModbusTransactionManager):
         :param tid: The transaction to remove
         '''
         _logger.debug("deleting transaction %d" % tid)
-        self.transactions.pop(tid, None)
+        self.getTransaction(tid)
+
+    def getNextTID(self):
+        ''' Retrieve the next unique transaction identifier
+
+        This skips the identifiers whose slot is still in use
+        (counted in collisions). Only if every slot is taken (by
+        responses nobody asked for) is the next slot reused.
+
+        :returns: The next unique transaction identifier
+        '''
+        tid = (self.tid + 1) & 0xffff
+        if self.__count <= self.__mask:
+            while self.__tids[tid & self.__mask] is not None:
+                self.collisions += 1
+                tid = (tid + 1) & 0xffff
+        self.tid = tid
+        return tid
+
+    def reset(self):
+        ''' Resets the transaction identifier and table '''
+        self.tid = Defaults.TransactionId
+        self.__count = 0
+        self.__tids = [None] * len(self.__tids)
+        self.transactions = [None] * len(self.transactions)
 
 
 class FifoTransactionManager(ModbusTransactionManager):
@@ -171,20 +227,26 @@ class FifoTransactionManager(ModbusTransactionManager):
     results are returned in a FIFO manner.
     '''
 
-    def __init__(self, client):
+    def __init__(self, client, window=Defaults.Window):
         ''' Initializes an instance of the ModbusTransactionManager
 
         :param client: The client socket wrapper
+        :param window: The number of transactions kept in flight
         '''
         super(FifoTransactionManager, self).__init__(client)
-        self.transactions = []
+        self.window = window
+        self.transactions = deque()
+
+    def __len__(self):
+        ''' Returns the number of transactions in flight '''
+        return len(self.transactions)
 
     def __iter__(self):
         ''' Iterater over the current managed transactions
 
         :returns: An iterator of the managed transactions
         '''
-        return iter(self.transactions)
+        return iter(list(self.transactions))
 
     def addTransaction(self, request, tid=None):
         ''' Adds a transaction to the handler
@@ -207,7 +269,7 @@ class FifoTransactionManager(ModbusTransactionManager):
         :param tid: The transaction to retrieve
         '''
         _logger.debug("getting transaction %s" % str(tid))
-        return self.transactions.pop(0) if self.transactions else None
+        return self.transactions.popleft() if self.transactions else None
 
     def delTransaction(self, tid):
         ''' Removes a transaction matching the referenced tid
@@ -215,7 +277,7 @@ class FifoTransactionManager(ModbusTransactionManager):
         :param tid: The transaction to remove
         '''
         _logger.debug("deleting transaction %d" % tid)
-        if self.transactions: self.transactions.pop(0)
+        if self.transactions: self.transactions.popleft()
 
 
 #---------------------------------------------------------------------------#
@@ -240,13 +302,24 @@ class ModbusSocketFramer(IModbusFramer):
         * The -1 is to account for the uid byte
     '''
 
+    __header_struct = struct.Struct('>HHHB')
+    __packet_struct = struct.Struct('>HHHBB')
+    __empty_header  = (0, 0, 0, 0)
+    __compact_size  = 4096
+
     def __init__(self, decoder):
         ''' Initializes a new instance of the framer
 
+        The received data is kept in a bytearray which is consumed by
+        advancing a read offset, it is only compacted once the consumed
+        part dominates the buffer. The header is kept as the unpacked
+        (tid, pid, len, uid) tuple.
+
         :param decoder: The decoder factory implementation to use
         '''
-        self.__buffer = ''
-        self.__header = {'tid':0, 'pid':0, 'len':0, 'uid':0}
+        self.__buffer = bytearray()
+        self.__offset = 0
+        self.__header = self.__empty_header
         self.__hsize  = 0x07
         self.decoder  = decoder
 
@@ -257,16 +330,16 @@ class ModbusSocketFramer(IModbusFramer):
         '''
         Check and decode the next frame Return true if we were successful
         '''
-        if len(self.__buffer) > self.__hsize:
-            self.__header['tid'], self.__header['pid'], \
-            self.__header['len'], self.__header['uid'] = struct.unpack(
-                    '>HHHB', self.__buffer[0:self.__hsize])
+        available = len(self.__buffer) - self.__offset
+        if available > self.__hsize:
+            self.__header = self.__header_struct.unpack_from(
+                    self.__buffer, self.__offset)
 
             # someone sent us an error? ignore it
-            if self.__header['len'] < 2:
+            if self.__header[2] < 2:
                 self.advanceFrame()
             # we have at least a complete message, continue
-            elif len(self.__buffer) - self.__hsize + 1 >= self.__header['len']:
+            elif available - self.__hsize + 1 >= self.__header[2]:
                 return True
         # we don't have enough of a message yet, wait
         return False
@@ -277,9 +350,15 @@ class ModbusSocketFramer(IModbusFramer):
         it or determined that it contains an error. It also has to reset the
         current frame header handle
         '''
-        length = self.__hsize + self.__header['len'] - 1
-        self.__buffer = self.__buffer[length:]
-        self.__header = {'tid':0, 'pid':0, 'len':0, 'uid':0}
+        self.__offset += self.__hsize + self.__header[2] - 1
+        self.__header = self.__empty_header
+        if self.__offset >= len(self.__buffer):
+            del self.__buffer[:]
+            self.__offset = 0
+        elif self.__offset >= self.__compact_size and \
+                self.__offset * 2 >= len(self.__buffer):
+            del self.__buffer[:self.__offset]
+            self.__offset = 0
 
     def isFrameReady(self):
         ''' Check if we should continue decode logic
@@ -288,7 +367,7 @@ class ModbusSocketFramer(IModbusFramer):
 
         :returns: True if ready, False otherwise
         '''
-        return len(self.__buffer) > self.__hsize
+        return len(self.__buffer) - self.__offset > self.__hsize
 
     def addToFrame(self, message):
         ''' Adds new packet data to the current frame buffer
@@ -302,8 +381,9 @@ class ModbusSocketFramer(IModbusFramer):
 
         :returns: The next full frame buffer
         '''
-        length = self.__hsize + self.__header['len'] - 1
-        return self.__buffer[self.__hsize:length]
+        start = self.__offset + self.__hsize
+        end = self.__offset + self.__hsize + self.__header[2] - 1
+        return memoryview(self.__buffer)[start:end].tobytes()
 
     def populateResult(self, result):
         '''
@@ -312,9 +392,8 @@ class ModbusSocketFramer(IModbusFramer):
 
         :param result: The response packet
         '''
-        result.transaction_id = self.__header['tid']
-        result.protocol_id = self.__header['pid']
-        result.unit_id = self.__header['uid']
+        result.transaction_id, result.protocol_id, _, result.unit_id = \
+            self.__header
 
     #-----------------------------------------------------------------------#
     # Public Member Functions
@@ -334,7 +413,8 @@ class ModbusSocketFramer(IModbusFramer):
         :param data: The new packet data
         :param callback: The function to send results to
         '''
-        _logger.debug(" ".join([hex(ord(x)) for x in data]))
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(" ".join([hex(ord(x)) for x in data]))
         self.addToFrame(data)
         while self.isFrameReady():
             if self.checkFrame():
@@ -352,7 +432,7 @@ class ModbusSocketFramer(IModbusFramer):
         :param message: The populated request/response to send
         '''
         data = message.encode()
-        packet = struct.pack('>HHHBB',
+        packet = self.__packet_struct.pack(
             message.transaction_id,
             message.protocol_id,
             len(data) + 2,
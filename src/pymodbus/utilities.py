@@ -5,7 +5,11 @@ Modbus Utilities
 A collection of utilities for packing data, unpacking
 data computing checksums, and decode checksums.
 '''
+import sys
 import struct
+from array import array
+from binascii import hexlify, unhexlify
+from itertools import chain, izip
 
 
 #---------------------------------------------------------------------------#
@@ -48,6 +52,138 @@ def dict_property(store, index):
 #---------------------------------------------------------------------------#
 # Bit packing functions
 #---------------------------------------------------------------------------#
+def __generate_bit_tables():
+    ''' Generates the byte <-> 8 bits lookup tables
+
+    .. note:: This will only be generated once
+    '''
+    unpack, pack = [], {}
+    for byte in range(256):
+        bits = tuple(((byte >> i) & 1) == 1 for i in range(8))
+        unpack.append(list(bits))
+        pack[bits] = chr(byte)
+    return unpack, pack
+
+_unpack_table, _pack_table = __generate_bit_tables()
+_padding = [[False] * (-size % 8) for size in range(8)]
+
+
+class BitVector(object):
+    ''' A compact sequence of bits kept in the packed modbus format
+
+    This can be used in place of the list returned by unpack_bitstring
+    when only a few of the bits are looked at::
+
+        bits = BitVector('\x05')
+        bits[0], bits[1], len(bits) # True, False, 8
+    '''
+    __slots__ = ('_data', '_size')
+
+    def __init__(self, data='', size=None):
+        ''' Initialize a new bit vector
+
+        :param data: The packed bits, least significant bit first
+        :param size: The number of bits (defaults to 8 per byte)
+        '''
+        self._data = bytearray(data)
+        if size is None: size = len(self._data) * 8
+        else: # drop the bytes and padding bits past size
+            del self._data[(size + 7) // 8:]
+            if size & 7: self._data[-1] &= (1 << (size & 7)) - 1
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __index(self, index):
+        if index < 0: index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('bit index out of range')
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        index = self.__index(index)
+        return (self._data[index >> 3] >> (index & 7)) & 1 == 1
+
+    def __setitem__(self, index, value):
+        index = self.__index(index)
+        if value: self._data[index >> 3] |= 1 << (index & 7)
+        else: self._data[index >> 3] &= ~(1 << (index & 7)) & 0xff
+
+    def __iter__(self):
+        table = _unpack_table
+        bits = [bit for byte in self._data for bit in table[byte]]
+        return iter(bits[:self._size])
+
+    def __eq__(self, other):
+        if isinstance(other, BitVector):
+            return self._size == other._size and \
+                self._data[:(self._size + 7) // 8] == \
+                other._data[:(other._size + 7) // 8]
+        if not isinstance(other, (list, tuple, array)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented: return result
+        return not result
+
+    def __repr__(self):
+        return 'BitVector(%r)' % list(self)
+
+    def tostring(self):
+        ''' Returns the packed bits
+
+        :returns: The bits packed as in pack_bitstring
+        '''
+        return str(self._data[:(self._size + 7) // 8])
+
+    def extract(self, start, count):
+        ''' Returns a range of bits without expanding them
+
+        :param start: The index of the first bit
+        :param count: The number of bits
+        :returns: A new BitVector holding the bits
+        '''
+        if count <= 0: return BitVector('', 0)
+        first, shift = start >> 3, start & 7
+        chunk = self._data[first:(start + count + 7) >> 3]
+        if shift:
+            value = _bytes_to_int(chunk) >> shift
+            chunk = _int_to_bytes(value, len(chunk))
+        return BitVector(chunk, count)
+
+    def assign(self, start, bits):
+        ''' Overwrites a range of bits starting at `start`
+
+        :param start: The index of the first bit
+        :param bits: The bit values (or a BitVector) to store
+        '''
+        if not isinstance(bits, BitVector):
+            bits = list(bits)
+        count = len(bits)
+        if count <= 0: return
+        first, last = start >> 3, (start + count + 7) >> 3
+        shift, mask = start & 7, (1 << count) - 1
+        value = _bytes_to_int(bytearray(pack_bitstring(bits))) & mask
+        chunk = self._data[first:last]
+        current = _bytes_to_int(chunk) & ~(mask << shift)
+        self._data[first:last] = _int_to_bytes(current | (value << shift), len(chunk))
+
+
+def _bytes_to_int(data):
+    ''' Little endian bytearray to integer '''
+    return int(hexlify(str(data[::-1])), 16) if data else 0
+
+
+def _int_to_bytes(value, size):
+    ''' Integer to little endian bytearray of `size` bytes '''
+    return bytearray(unhexlify('%0*x' % (size * 2, value))[::-1])
+
+
 def pack_bitstring(bits):
     ''' Creates a string out of an array of bits
 
@@ -58,19 +194,15 @@ def pack_bitstring(bits):
         bits   = [False, True, False, True]
         result = pack_bitstring(bits)
     '''
-    ret = ''
-    i = packed = 0
-    for bit in bits:
-        if bit: packed += 128
-        i += 1
-        if i == 8:
-            ret += chr(packed)
-            i = packed = 0
-        else: packed >>= 1
-    if i > 0 and i < 8:
-        packed >>= (7 - i)
-        ret += chr(packed)
-    return ret
+    if isinstance(bits, BitVector):
+        return bits.tostring()
+    bits = list(bits)
+    bits.extend(_padding[len(bits) & 7])
+    try:
+        if len(bits) == 8: return _pack_table[tuple(bits)]
+        return ''.join(map(_pack_table.__getitem__, izip(*[iter(bits)] * 8)))
+    except KeyError: # not only booleans, 0 or 1
+        return pack_bitstring([bool(bit) for bit in bits])
 
 
 def unpack_bitstring(string):
@@ -83,14 +215,65 @@ def unpack_bitstring(string):
         bytes  = 'bytes to decode'
         result = unpack_bitstring(bytes)
     '''
-    byte_count = len(string)
-    bits = []
-    for byte in range(byte_count):
-        value = ord(string[byte])
-        for _ in range(8):
-            bits.append((value & 1) == 1)
-            value >>= 1
-    return bits
+    return list(chain.from_iterable(
+        map(_unpack_table.__getitem__, bytearray(string))))
+
+
+#---------------------------------------------------------------------------#
+# Register packing functions
+#---------------------------------------------------------------------------#
+__register_structs = {}
+__register_cache_limit = 125 # the most registers a single request carries
+
+
+def register_struct(count):
+    ''' Returns the big endian struct for a block of registers
+
+    Only the blocks that fit in a request are cached, the counts read
+    from the wire go up to 65535 and each struct is sized by its count.
+
+    :param count: The number of registers in the block
+    :returns: A struct.Struct packing `count` registers
+    '''
+    handle = __register_structs.get(count)
+    if handle is None:
+        handle = struct.Struct('>%dH' % count)
+        if count <= __register_cache_limit:
+            __register_structs[count] = handle
+    return handle
+
+
+def pack_registers(registers):
+    ''' Creates a big endian string out of a list or array('H')
+    of registers
+
+    :param registers: The register values to pack
+    :returns: The packed registers
+    '''
+    if isinstance(registers, array):
+        if sys.byteorder == 'little':
+            registers = registers[:]
+            registers.byteswap()
+        return registers.tostring()
+    return register_struct(len(registers)).pack(*registers)
+
+
+def unpack_registers(data, offset, count):
+    ''' Creates a list of registers out of a big endian string
+
+    :param data: The modbus data packet to decode
+    :param offset: The offset of the first register in the packet
+    :param count: The number of registers to decode
+    :returns: The list of decoded registers
+    '''
+    if count < 0 or len(data) - offset < count * 2:
+        raise struct.error('unpack requires %d bytes' % (count * 2))
+    if count > __register_cache_limit:
+        registers = array('H')
+        registers.fromstring(data[offset:offset + count * 2])
+        if sys.byteorder == 'little': registers.byteswap()
+        return registers.tolist()
+    return list(register_struct(count).unpack_from(data, offset))
 
 
 #---------------------------------------------------------------------------#
@@ -195,6 +378,7 @@ def rtuFrameSize(buffer, byte_count_pos):
 # Exported symbols
 #---------------------------------------------------------------------------#
 __all__ = [
-    'pack_bitstring', 'unpack_bitstring', 'default',
+    'pack_bitstring', 'unpack_bitstring', 'default', 'BitVector',
+    'register_struct', 'pack_registers', 'unpack_registers',
     'computeCRC', 'checkCRC', 'computeLRC', 'checkLRC', 'rtuFrameSize'
 ]